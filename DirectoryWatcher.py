@@ -1,22 +1,45 @@
 import time
-import rarfile
 from watchdog.observers import Observer
 
 from Handler import Handler
+from Scheduler import Scheduler
+from WorkerPool import WorkerPool
+from archives import set_unrar_tool
+from metrics import JsonLinesSink, MetricsServer, metrics
 
 
 class Watcher:
     def __init__(self, directory_to_watch, config):
         self.DIRECTORY_TO_WATCH = directory_to_watch
         self.config = config
-        rarfile.UNRAR_TOOL = self.config['unrar_tool']
-        self.observer = Observer()
+        set_unrar_tool(self.config['unrar_tool'])
+        if config.get('POLLING_OBSERVER'):
+            from watchdog.observers.polling import PollingObserver
+            self.observer = PollingObserver()
+        else:
+            self.observer = Observer()
         self.running = False
 
     def run(self):
         self.running = True
-        event_handler = Handler(self.config)
+        # One pool for the lifetime of the watcher, shared by every archive
+        pool = WorkerPool(self.config)
+        scheduler = Scheduler(self.config.get('MAX_CONCURRENT_ARCHIVES', 2), self.config.get('JOB_QUEUE_SIZE', 64),
+                              self.config.get('MEMORY_BUDGET_MB', 2048))
+        event_handler = Handler(self.config, pool, scheduler)
+
+        metrics.register_gauge('queue_depth', scheduler.jobs.qsize)
+        metrics.register_gauge('archives_running', lambda: len(scheduler.running_jobs))
+        metrics.register_gauge('memory_reserved_bytes', lambda: scheduler.memory.used)
+        sink = JsonLinesSink(self.config['METRICS_LOG']) if self.config.get('METRICS_LOG') else None
+        if sink:
+            metrics.add_sink(sink)
+        server = MetricsServer(metrics, self.config['METRICS_PORT']) if self.config.get('METRICS_PORT') else None
+        if server:
+            server.start()
+
         self.observer.schedule(event_handler, self.DIRECTORY_TO_WATCH, recursive=True)
+        event_handler.start()
         self.observer.start()
         print(f"Observer started. Monitoring {self.DIRECTORY_TO_WATCH}")
         try:
@@ -25,6 +48,13 @@ class Watcher:
         finally:
             self.observer.stop()
             self.observer.join()
+            event_handler.stop()
+            pool.shutdown()
+            if server:
+                server.stop()
+            if sink:
+                metrics.remove_sink(sink)
+                sink.close()
 
     def stop(self):
         self.running = False
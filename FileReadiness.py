@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+
+from archives import first_volume, volume_paths
+from metrics import metrics
+
+
+class ReadinessTracker:
+    """
+    Waits until dropped files are completely written before handing them over to on_ready.
+
+    Repeated events for the same path are coalesced into one pending entry. A file counts as ready once its
+    size and mtime have not changed for stable_seconds (polled with a growing interval) or right after a
+    'closed' event, and it can be opened for reading. A folder counts as ready once the number, total size
+    and latest mtime of the files below it have not changed for its stable_seconds; a 'closed' event of one of
+    its files says nothing about the others. A RAR volume set (notified by its first volume) counts as ready
+    once none of its volumes has changed for stable_seconds and is_complete says that none is missing any more.
+    on_ready runs on the tracker's own thread.
+    """
+
+    def __init__(self, on_ready, stable_seconds=1.0, poll_interval=0.25, max_poll_interval=2.0, is_complete=None):
+        self.on_ready = on_ready
+        self.is_complete = is_complete
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+        self.pending = {}  # path -> state of the pending file
+        self.active = set()  # paths handed over to on_ready and not finished yet
+        # Seconds from the first event to the start of work
+        self.wait_stats = {'ready': 0, 'total_wait_s': 0.0, 'max_wait_s': 0.0}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def notify(self, path, closed=False, stable_seconds=None):
+        """
+        Registers an event for path; duplicates of a pending or active path are merged.
+        stable_seconds overrides the quiet period for this path (e.g. longer for dropped folders).
+        """
+        path = os.path.abspath(path)
+        now = time.monotonic()
+        with self.condition:
+            if path in self.active:
+                return
+            state = self.pending.get(path)
+            if state is None:
+                state = self.pending[path] = {'arrived': now, 'signature': None, 'stable_since': now,
+                                              'interval': self.poll_interval, 'closed': False,
+                                              'stable_seconds': stable_seconds or self.stable_seconds}
+            # Any new event restarts the polling at the shortest interval
+            state['next_check'] = now if closed else now + self.poll_interval
+            state['interval'] = self.poll_interval
+            state['closed'] = state['closed'] or closed
+            self.condition.notify()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        with self.condition:
+            ready = self.wait_stats['ready']
+            return {
+                'ready': ready,
+                'pending': len(self.pending),
+                'avg_wait_s': round(self.wait_stats['total_wait_s'] / ready, 3) if ready else 0.0,
+                'max_wait_s': round(self.wait_stats['max_wait_s'], 3)
+            }
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                due = [path for path, state in self.pending.items() if state['next_check'] <= now]
+                if not due:
+                    next_check = min((state['next_check'] for state in self.pending.values()), default=None)
+                    self.condition.wait(None if next_check is None else next_check - now)
+                    continue
+
+            for path in due:
+                if self.check(path) and self.complete(path):
+                    self.hand_over(path)
+
+    def check(self, path):
+        """Polls path once; returns True when it is ready to be processed."""
+        try:
+            signature = self.signature(path)
+        except FileNotFoundError:
+            with self.condition:
+                self.pending.pop(path, None)  # moved away or deleted before it was ready
+            return False
+        except OSError:
+            signature = None
+
+        now = time.monotonic()
+        with self.condition:
+            state = self.pending.get(path)
+            if state is None:
+                return False
+            unchanged = signature is not None and signature == state['signature']
+            if unchanged:
+                if state['closed'] or now - state['stable_since'] >= state['stable_seconds']:
+                    return True
+            elif signature is not None and state['closed']:
+                # The writer has closed the file, a single readable observation is enough
+                state['signature'] = signature
+                return True
+            else:
+                state['signature'] = signature
+                state['stable_since'] = now
+            # Back off while the file keeps changing, but don't overshoot the end of a stable window
+            state['next_check'] = now + state['interval']
+            if unchanged:
+                state['next_check'] = min(state['next_check'], state['stable_since'] + state['stable_seconds'])
+            state['interval'] = min(state['interval'] * 2, self.max_poll_interval)
+            return False
+
+    def complete(self, path):
+        """Whether a stable path is all there (see is_complete); if not, it stays pending and is polled again."""
+        if self.is_complete is None or self.is_complete(path):
+            return True
+        with self.condition:
+            state = self.pending.get(path)
+            if state is not None:
+                if not state.get('incomplete'):
+                    print(f"Waiting for the missing volumes of {path}")
+                state['incomplete'] = True
+                state['next_check'] = time.monotonic() + self.max_poll_interval
+        return False
+
+    @staticmethod
+    def signature(path):
+        """Returns what has to stay unchanged for path to count as completely written."""
+        stat = os.stat(path)
+        if os.path.isdir(path):
+            count, size, mtime = 0, 0, stat.st_mtime_ns
+            for root, dirs, files in os.walk(path):
+                for file in files:
+                    try:
+                        file_stat = os.stat(os.path.join(root, file))
+                    except FileNotFoundError:
+                        continue  # e.g. a temporary file of the copy, the next poll sees the change
+                    count += 1
+                    size += file_stat.st_size
+                    mtime = max(mtime, file_stat.st_mtime_ns)
+            return count, size, mtime
+        if first_volume(path):
+            # Every volume there so far has to stay unchanged, and a volume arriving restarts the wait
+            volumes = []
+            for volume in volume_paths(path):
+                with open(volume, 'rb'):
+                    pass
+                volume_stat = os.stat(volume)
+                volumes.append((volume_stat.st_size, volume_stat.st_mtime_ns))
+            return tuple(volumes)
+        with open(path, 'rb'):
+            pass  # still locked by the writer on some platforms
+        return stat.st_size, stat.st_mtime_ns
+
+    def hand_over(self, path):
+        with self.condition:
+            state = self.pending.pop(path, None)
+            if state is None:
+                return
+            self.active.add(path)
+            waited = time.monotonic() - state['arrived']
+            self.wait_stats['ready'] += 1
+            self.wait_stats['total_wait_s'] += waited
+            self.wait_stats['max_wait_s'] = max(self.wait_stats['max_wait_s'], waited)
+        # Up to the hand-over: the time in the job queue until work starts is the Scheduler's 'queue_wait' span
+        metrics.record_span('ready_wait', waited, archive=os.path.basename(path))
+        print(f"Ready after {waited:.2f}s: {path}")
+        try:
+            self.on_ready(path)
+        finally:
+            with self.condition:
+                self.active.discard(path)
@@ -1,132 +1,501 @@
 import os
 import shutil
+import threading
 import time
-import py7zr
-import rarfile
-import zipfile
-from watchdog.events import FileSystemEventHandler
-from concurrent.futures import ThreadPoolExecutor
-from utils import apply_watermark, compress_image, compress_and_move_folder, support_gbk
-
-
-class Handler(FileSystemEventHandler):
-    def __init__(self, config):
+from collections import deque
+from contextlib import contextmanager
+from utils import apply_watermark, compress_image, compress_and_move_folder, finish_page, is_replaced_in_place, \
+    jpeg_output_path, page_footprint, watermark_and_compress, watermark_and_compress_bytes, watermark_cache_info
+from WorkerPool import WorkerPool
+from metrics import metrics
+from Journal import Journal
+from ZipWriter import ZipWriter
+from FileReadiness import ReadinessTracker
+from archives import ARCHIVE_EXTENSIONS, Archive, MemberFilter, first_volume, open_source, volume_paths, \
+    volumes_complete
+
+# Late watchdog events of a file the handler wrote into the watched folder are dropped for this long
+OWN_FILE_GRACE_SECONDS = 30
+
+
+class Handler:
+    """
+    Processes archives, and plain folders of pages dropped into the watched folder (FOLDER_DROP). Watcher
+    schedules it as a watchdog event handler (through dispatch()), batch.py submits archives and folders
+    directly; watchdog itself is not imported here, so the headless batch mode does not need it.
+    """
+
+    def __init__(self, config, pool=None, scheduler=None):
         self.config = config
+        # Watcher passes its long-lived pool; a standalone Handler creates its own
+        self.pool = pool or WorkerPool(config)
+        # Without a scheduler, ready archives are processed one at a time on the readiness thread
+        self.scheduler = scheduler
+        # Pages that failed in the job running on each thread (pages are recorded on the job's thread)
+        self.job_failures = threading.local()
+        # Finished pages and archives, reused for re-uploads and pages shared between chapters
+        self.cache = None
+        if config.get('RESULT_CACHE_DIR'):
+            from ResultCache import ResultCache
+            self.cache = ResultCache(config['RESULT_CACHE_DIR'], config.get('RESULT_CACHE_MB', 1024))
+        # JPEG options and per-page quality search of the page stages (None: plain OUTPUT_QUALITY)
+        from encoder import settings_from_config
+        self.encoder = settings_from_config(config)
+        # Members dropped before extraction (OS metadata, nested archives, ...)
+        self.member_filter = MemberFilter.from_config(config)
+        # Archives are only processed once they are completely written (with all their volumes), see start()
+        self.readiness = ReadinessTracker(self.on_ready, config.get('READY_STABLE_SECONDS', 1.0),
+                                          is_complete=volumes_complete)
+        # Archives are extracted here, outside the watched folder, so processing them raises no events at all
+        self.work_root = os.path.abspath(config['WORK_DIR']) if config.get('WORK_DIR') else None
+        # What the handler itself writes inside the watched folder, its events are dropped (see is_own()):
+        # top-level folders (archives extracted without a WORK_DIR, dropped folders being processed) and
+        # files moved or written there (outputs of archives in sub folders) for OWN_FILE_GRACE_SECONDS
+        self.watch_root = os.path.abspath(config.get('WORKING_DIR', '_target_'))
+        self.owned = set()
+        self.written = {}  # path -> expiry (time.monotonic())
+        self.owned_lock = threading.Lock()
+        # Other workers sharing the watched folder, see process_job(). Spool is only loaded with a SPOOL_DIR
+        self.spool = None
+        if config.get('SPOOL_DIR'):
+            from Spool import Spool
+            self.spool = Spool(config['SPOOL_DIR'], self.watch_root, config.get('WORKER_ID', ''),
+                               config.get('HEARTBEAT_SECONDS', 5.0), config.get('WORKER_TIMEOUT_SECONDS', 30.0),
+                               on_reclaim=self.on_ready, process_shard=self.process_shard,
+                               shard_timeout_seconds=config.get('SHARD_TIMEOUT_SECONDS', 600.0))
+        # Archive and page progress, to resume interrupted jobs without watermarking a page twice. With a spool
+        # every worker keeps its own journal, the jobs of a dead worker are reclaimed by the others instead
+        journal_file = config.get('JOURNAL_FILE')
+        if journal_file and self.spool:
+            base, extension = os.path.splitext(journal_file)
+            journal_file = f"{base}.{self.spool.worker_id}{extension}"
+        self.journal = Journal(journal_file) if journal_file else None
+
+    def start(self):
+        if self.spool:
+            self.spool.start()
+        if self.scheduler:
+            self.scheduler.start(self.process_job, self.output_path)
+        self.readiness.start()
+        self.resume_unfinished()
+
+    def stop(self):
+        self.readiness.stop()
+        print(f"Readiness: {self.readiness.stats()}")
+        if self.scheduler:
+            skipped = self.scheduler.stop(drain=self.config.get('DRAIN_ON_STOP', True))
+            # Queued jobs left unprocessed are journaled, so resume_unfinished() queues them again on the next start
+            for path in skipped if self.journal else []:
+                if not self.journal.get(path):
+                    self.journal.record(path, 'started')
+            print(f"Scheduler: {self.scheduler.stats()}")
+        if self.spool:
+            self.spool.stop()
+            print(f"Spool: {self.spool.stats()}")
+        if self.journal:
+            self.journal.close()
+
+    def on_ready(self, path):
+        if self.scheduler:
+            self.scheduler.submit(path)
+        else:
+            self.process_job(path)
+
+    def dispatch(self, event):
+        # Called by the watchdog observer, same as FileSystemEventHandler.dispatch
+        self.on_any_event(event)
 
     def on_any_event(self, event):
-        if event.is_directory or not event.event_type == 'created':
+        metrics.inc('events')
+        # Duplicated created/modified events are merged by the readiness tracker
+        if event.event_type == 'moved':
+            path = event.dest_path
+        elif event.event_type in ('created', 'modified', 'closed'):
+            path = event.src_path
+        else:
             return None
 
-        if event.src_path.endswith('.rar'):
-            print(f"RAR file detected: {event.src_path}")
-            Handler.extract_rar(self, event.src_path)
-        elif event.src_path.endswith('.7z'):
-            print(f"7z file detected: {event.src_path}")
-            self.extract_7z(event.src_path)
-        elif event.src_path.endswith('.zip'):
-            print(f"ZIP file detected: {event.src_path}")
-            self.extract_zip(event.src_path)
-
-    def extract_rar(self, file_path):
-        # Initial delay for file write completion
-        time.sleep(2)
+        if self.is_own(path):
+            metrics.inc('events_ignored')
+        elif not event.is_directory and first_volume(path):
+            # Any volume of a set stands for the whole set, processed once from its first volume. A volume being
+            # closed says nothing about the others
+            self.readiness.notify(first_volume(path))
+        elif not event.is_directory and path.endswith(ARCHIVE_EXTENSIONS):
+            self.readiness.notify(path, closed=event.event_type == 'closed')
+        elif self.config.get('FOLDER_DROP', True):
+            # Any change below a dropped folder restarts its quiet period
+            folder = self.top_folder(path, event.is_directory)
+            if folder:
+                self.readiness.notify(folder, stable_seconds=self.config.get('FOLDER_STABLE_SECONDS', 3.0))
+
+    def top_folder(self, path, is_directory=True):
+        """Returns the top-level folder of the watched folder that path is in (None for files right in it)."""
+        relative = os.path.relpath(os.path.abspath(path), self.watch_root)
+        parts = relative.split(os.sep)
+        if relative == '.' or parts[0] == '..' or (len(parts) == 1 and not is_directory):
+            return None
+        return os.path.join(self.watch_root, parts[0])
+
+    def is_own(self, path):
+        """Whether path was written by the handler itself, see owning() and claim()."""
+        path = os.path.abspath(path)
+        with self.owned_lock:
+            expiry = self.written.get(path)
+            if expiry is not None:
+                if expiry > time.monotonic():
+                    return True
+                del self.written[path]
+            return self.top_folder(path) in self.owned
+
+    def claim(self, *paths):
+        """
+        Marks files about to be written or moved into the watched folder (outputs of archives in sub folders) as
+        the handler's own. Call again once written: their late events are dropped for OWN_FILE_GRACE_SECONDS.
+        """
+        expiry = time.monotonic() + OWN_FILE_GRACE_SECONDS
+        with self.owned_lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if not os.path.relpath(path, self.watch_root).startswith('..'):
+                    self.written[path] = expiry
+
+    @contextmanager
+    def owning(self, path):
+        """Marks the top-level folder of the watched folder that path is in as written by the handler."""
+        folder = self.top_folder(path)
+        with self.owned_lock:
+            added = folder is not None and folder not in self.owned
+            if added:
+                self.owned.add(folder)
+        # Keeps the other workers of the spool from taking it for a dropped folder as well
+        claimed = added and self.spool and self.spool.claim(folder, job=False)
+        try:
+            yield
+        finally:
+            if claimed:
+                self.spool.release(folder)
+            if added:
+                with self.owned_lock:
+                    self.owned.discard(folder)
+
+    def work_directory(self, target_directory, file_path):
+        """
+        Folder an archive of target_directory is extracted into: a folder of its own under WORK_DIR (its path relative
+        to the watched folder), so archives holding the same folder never share it, or else target_directory itself.
+        """
+        if not self.work_root:
+            return target_directory
+        relative = os.path.relpath(os.path.abspath(file_path), self.watch_root)
+        return os.path.join(self.work_root, os.path.basename(file_path) if relative.startswith('..') else relative)
+
+    def output_path(self, path):
+        """Path of the output .zip of an archive or dropped folder (None if it cannot be read), see Scheduler."""
+        path = os.path.abspath(path)
+        try:
+            if os.path.isdir(path):
+                name = os.path.basename(path)
+            else:
+                with Archive(path, self.member_filter) as source:
+                    name = source.output_name
+        except Exception:
+            return None
+        return os.path.join(os.path.dirname(os.path.dirname(path)), f"{name}.zip")
+
+    def process_job(self, path):
+        """
+        Processes an archive (or dropped folder) that is ready, once this worker has claimed it in the spool.
+        Every worker sees the same archives; the ones claimed by another worker are skipped, they are queued again
+        by the spool if that worker dies.
+        """
+        if not self.spool:
+            return self.process_archive(path)
+        if not self.spool.claim(path):
+            print(f"Skipped {path}: claimed by worker {self.spool.holder(path)}")
+            metrics.inc('jobs_skipped')
+            return None
+        try:
+            # Finished by another worker since it was seen
+            if os.path.exists(path):
+                metrics.inc('jobs_claimed')
+                self.process_archive(path)
+        finally:
+            self.spool.release(path)
+
+    def process_archive(self, path):
+        """Extracts (or streams) and processes an archive that is ready."""
+        with metrics.span('archive', archive=os.path.basename(path)):
+            job = self.journal.get(path) if self.journal else None
+            if job and job['state'] in ('planned', 'extracted', 'zipped'):
+                final_zip_path = self.resume_archive(path, job)
+            else:
+                if self.journal:
+                    self.journal.record(path, 'started')
+                cached = self.cache and not os.path.isdir(path)
+                final_zip_path = self.process_archive_cached(path) if cached else self.dispatch_archive(path)
+            if self.journal:
+                self.journal.record(path, 'finished' if final_zip_path else 'failed')
+            if self.work_root and not os.path.isdir(path):
+                # The archive's own folder under WORK_DIR, what is left of it once the folder inside is zipped
+                shutil.rmtree(self.work_directory(os.path.dirname(path), path), ignore_errors=True)
+        metrics.inc('archives')
+
+    def resume_archive(self, path, job):
+        """Continues an archive from the journal of an interrupted run."""
+        target_directory = os.path.dirname(path)
+        if job['state'] == 'zipped':
+            if os.path.exists(path):
+                self.move_original_file(path, target_directory, job['zip'])
+            return job['zip']
+
+        # Every page must still be there, either as the source PNG or as the finished JPG. An archive whose
+        # extraction was cut short has its pages that are not done extracted again instead
+        extracting = job['state'] == 'planned' and not os.path.isdir(path)
+        resumable = os.path.exists(path) and (extracting or os.path.isdir(job['extracted_subdir']) and all(
+            os.path.exists(page) or os.path.exists(os.path.splitext(page)[0] + '.jpg') for page in job['pages']))
+        if not resumable:
+            if not os.path.exists(path):
+                print(f"Cannot resume {path}: the archive is gone")
+                return None
+            print(f"Cannot resume {path}, starting over")
+            self.journal.record(path, 'started')
+            return self.dispatch_archive(path)
+
+        print(f"Resuming {path}: {len(job['done'])} of {len(job['pages'])} pages already done")
+        with self.owning(job['extracted_subdir']):
+            return self.process_extracted_files(job['extracted_subdir'], target_directory, path, job)
+
+    def resume_unfinished(self):
+        """Queues the archives the journal lists as unfinished, e.g. after a crash."""
+        for path in self.journal.unfinished() if self.journal else []:
+            print(f"Unfinished job found: {path}")
+            self.on_ready(path)
+
+    def process_archive_cached(self, path):
+        """Whole-archive fast path: an archive that was already processed is answered from the result cache."""
+        from ResultCache import file_sha256
+        archive_key = self.cache.fingerprint(self.config, 'archive',
+                                             *[file_sha256(volume) for volume in volume_paths(path)],
+                                             self.config['PAGE_IGNORE_COUNT'], bool(self.config.get('STREAMING')),
+                                             self.config.get('PIPELINE_MODE'), self.config.get('MEMBER_INCLUDE'),
+                                             self.config.get('MEMBER_EXCLUDE'), self.config.get('MAX_MEMBER_MB'))
+        cached_zip = self.cache.get_archive(archive_key)
+        final_zip_path = None
+        if cached_zip:
+            target_directory = os.path.dirname(os.path.abspath(path))
+            final_zip_path = os.path.join(os.path.dirname(target_directory), os.path.basename(cached_zip))
+            self.claim(final_zip_path, final_zip_path + '.part')
+            shutil.copyfile(cached_zip, final_zip_path + '.part')
+            os.replace(final_zip_path + '.part', final_zip_path)
+            self.claim(final_zip_path)
+            self.move_original_file(path, target_directory, final_zip_path)
+            print(f"Result cache hit, zip file copied to: {final_zip_path}")
+        else:
+            # Cached as soon as it is written, before the original is moved next to it, unless a page failed
+            self.job_failures.pages = 0
 
+            def cache_output(output):
+                if self.job_failures.pages:
+                    print(f"Not cached: {self.job_failures.pages} pages of {os.path.basename(path)} failed")
+                else:
+                    self.cache.put_archive(archive_key, output)
+            final_zip_path = self.dispatch_archive(path, cache_output)
+        print(f"Result cache: {self.cache.stats()}")
+        return final_zip_path
+
+    def dispatch_archive(self, path, on_output=None):
+        """
+        Returns the path of the output zip, or None if the archive could not be processed.
+        on_output(output zip) runs once an archive's output is written, before the original is moved.
+        """
+        if os.path.isdir(path):
+            print(f"Folder detected: {path}")
+            return self.process_folder(path)
+        elif self.config.get('STREAMING'):
+            print(f"Archive detected: {path}")
+            return self.stream_archive(path, on_output)
+        elif path.endswith(ARCHIVE_EXTENSIONS):
+            print(f"{os.path.splitext(path)[1][1:].upper()} file detected: {path}")
+            return self.extract_archive(path, on_output)
+
+    def extract_archive(self, file_path, on_output=None):
+        """
+        Extracts the archive next to it and processes the pages, reading the archive headers only once.
+        The extraction runs in the background (EXTRACT_WORKERS ranges of members, see Archive.extract_async()):
+        in fused mode every page goes to the page stage as soon as it is on disk.
+        """
         target_directory = os.path.dirname(os.path.abspath(file_path))
+        work_directory = self.work_directory(target_directory, file_path)
+        archive = os.path.basename(file_path)
         try:
-            with rarfile.RarFile(file_path) as rf:
-                rf.extractall(target_directory)
-            print(f"Extracted: {file_path}")
-
-            extracted_subdir = self.determine_extracted_subdirectory(file_path, target_directory)
-            if extracted_subdir:
-                self.process_extracted_files(extracted_subdir, target_directory, file_path)
-
-            # Moving the original .rar file after processing (duplicate step)
-            # self.move_original_file(file_path, target_directory)
+            os.makedirs(work_directory, exist_ok=True)
+            source = Archive(file_path, self.member_filter)
+            start = time.perf_counter()
+
+            def extracted(error):
+                metrics.record_span('extract', time.perf_counter() - start, archive=archive)
+                if error is None:
+                    print(f"Extracted: {file_path}")
+
+            workers = self.config.get('EXTRACT_WORKERS', 1)
+            # Without a WORK_DIR, the extracted folder is in the watched folder but is not a dropped folder
+            with self.owning(source.page_directory(work_directory)), source, \
+                    source.extract_async(work_directory, workers, extracted) as extraction:
+                self.report_skipped(source)
+
+                extracted_subdir = self.determine_extracted_subdirectory(file_path, work_directory, source)
+                if extracted_subdir:
+                    return self.process_extracted_files(extracted_subdir, target_directory, file_path,
+                                                        source=source, work_directory=work_directory,
+                                                        extraction=extraction, on_output=on_output)
+                extraction.wait()
 
         except Exception as e:
-            print(f"Error during extraction or processing: {e}")
-
-    def extract_7z(self, file_path):
-        # Initial delay for file write completion
-        time.sleep(2)
-
+            metrics.inc('errors')
+            print(f"Error during extraction or processing of {file_path}: {e}")
+
+    def stream_archive(self, file_path, on_output=None):
+        """
+        Streaming mode: page members are read into memory, processed on the worker pool and written straight
+        into the output ZIP. Other members are copied through. Nothing is extracted into the watched folder.
+        At most MAX_IN_FLIGHT_PAGES pages are held in memory at a time.
+        """
         target_directory = os.path.dirname(os.path.abspath(file_path))
+        archive = os.path.basename(file_path)
         try:
-            with py7zr.SevenZipFile(file_path, mode='r') as z:
-                z.extractall(path=target_directory)
-            print(f"Extracted: {file_path}")
-
-            extracted_subdir = self.determine_extracted_subdirectory(file_path, target_directory)
-            if extracted_subdir:
-                self.process_extracted_files(extracted_subdir, target_directory, file_path)
-
-            # Move the original .7z file after processing
-            # self.move_original_file(file_path, target_directory)
-
-        except py7zr.exceptions.ArchiveError as e:
-            # This catches errors specific to 7z archives
-            print(f"Error during 7z extraction: {e}")
+            with Archive(file_path, self.member_filter) as source:
+                self.report_skipped(source)
+                final_zip_path = self.stream_pages(source, target_directory, archive)
+            if on_output:
+                on_output(final_zip_path)
+            with metrics.span('move', archive=archive):
+                self.move_original_file(file_path, target_directory, final_zip_path)
+            return final_zip_path
 
         except Exception as e:
-            # This catches any other general exception
-            print(f"Unexpected error during 7z extraction: {e}")
-
-    def extract_zip(self, file_path):
-        time.sleep(2)  # Delay to ensure the file is not being written to
-
-        target_directory = os.path.dirname(os.path.abspath(file_path))
+            metrics.inc('errors')
+            print(f"Error during streaming of {file_path}: {e}")
+
+    def process_folder(self, folder):
+        """
+        Folder-drop mode: the pages of a plain folder dropped into the watched folder are processed without any
+        archive round-trip. By default they are processed in place (like extracted pages), then the folder is
+        zipped next to the watched folder and deleted. With STREAMING the folder is only read, and moved next to
+        the output .zip afterwards like an original archive.
+        """
+        target_directory = os.path.dirname(folder)
         try:
-            with support_gbk(zipfile.ZipFile(file_path, 'r')) as zip_ref:
-                zip_ref.extractall(target_directory)
-            print(f"Extracted: {file_path}")
-
-            extracted_subdir = self.determine_extracted_subdirectory(file_path, target_directory)
-            if extracted_subdir:
-                self.process_extracted_files(extracted_subdir, target_directory, file_path)
+            with self.owning(folder):
+                source = open_source(folder, self.member_filter)
+                if not source.pages:
+                    print(f"No pages in {folder}, skipped")
+                    return None
+                self.report_skipped(source)
+                if not self.config.get('STREAMING'):
+                    return self.process_extracted_files(folder, target_directory, folder, source=source)
+
+                final_zip_path = self.stream_pages(source, target_directory, os.path.basename(folder))
+                with metrics.span('move', archive=os.path.basename(folder)):
+                    self.move_original_file(folder, target_directory)
+                return final_zip_path
 
         except Exception as e:
-            print(f"Error during ZIP extraction: {e}")
-
-    def determine_extracted_subdirectory(self, file_path, target_directory):
-        extracted_subdir = None
+            metrics.inc('errors')
+            print(f"Error during processing of folder {folder}: {e}")
 
-        # Handling for RAR files
-        if file_path.endswith('.rar'):
-            with rarfile.RarFile(file_path) as archive_file:
-                all_names = [f.filename for f in archive_file.infolist()]
-                first_extracted_file = all_names[0] if all_names else None
+    def stream_pages(self, source, target_directory, archive):
+        """Writes the output ZIP of an open Archive (or Folder) in streaming mode and returns its path."""
+        png_names = source.pages
+        page_ignore_count = max(0, min(self.config['PAGE_IGNORE_COUNT'], len(png_names)))
+        png_set = set(png_names)
+        to_watermark = set(png_names[:len(png_names) - page_ignore_count])
 
-        # Handling for 7z files
-        elif file_path.endswith('.7z'):
-            with py7zr.SevenZipFile(file_path, mode='r') as archive_file:
-                all_names = archive_file.getnames()
-                first_extracted_file = next(iter(all_names), None)
+        # Keep the folder inside the archive as the output folder, or use the archive name for flat archives
+        zip_name = source.output_name
+        arcname = source.output_arcname
 
-        # Handling for ZIP files
-        elif file_path.endswith('.zip'):
-            with support_gbk(zipfile.ZipFile(file_path, 'r')) as archive_file:
-                all_names = archive_file.namelist()
-                first_extracted_file = next(iter(all_names), None)
-
-        else:
-            print(f"Unsupported file type: {file_path}")
-            return None
-
-        if first_extracted_file:
-            # Attempt to find a common base directory if there is one
-            common_dir = os.path.commonprefix(all_names).rstrip("/\\")
-            if common_dir:
-                # For archives where a common directory exists
-                extracted_subdir = os.path.join(target_directory, common_dir)
-            else:
-                # For archives without a common subdirectory, or if the archive is flat
-                extracted_dir_path = os.path.dirname(first_extracted_file) or ""
-                if extracted_dir_path:
-                    extracted_subdir = os.path.join(target_directory, extracted_dir_path)
+        parent_directory = os.path.dirname(target_directory)
+        final_zip_path = os.path.join(parent_directory, f"{zip_name}.zip")
+        self.claim(final_zip_path, final_zip_path + '.part')
+
+        fingerprint = self.cache.fingerprint(self.config) if self.cache else None
+        in_flight = deque()
+        max_in_flight = max(1, self.config.get('MAX_IN_FLIGHT_PAGES', 16))
+        with ZipWriter(final_zip_path, self.config.get('ZIP_MODE', 'auto'), self.pool.io) as writer:
+            def write_oldest():
+                name, data, future, key = in_flight.popleft()
+                if future is None:
+                    # Result cache hit, data is the finished JPEG
+                    metrics.inc('pages', archive=archive)
+                    writer.add_bytes(arcname(os.path.splitext(name)[0] + '.jpg'), data)
+                    return
+                output, stats = future.result()
+                self.record_page(stats, archive)
+                if key and output is not None:
+                    self.cache.put_page(key, output)
+                if output is None:
+                    # Keep the page as it is, like the extract mode does when a page fails
+                    writer.add_bytes(arcname(name), data)
+                else:
+                    writer.add_bytes(arcname(os.path.splitext(name)[0] + '.jpg'), output)
+
+            members = source.iter_members(max_in_flight)
+            while True:
+                # Reading the next member is the extract stage of the streaming mode
+                with metrics.span('extract', archive=archive):
+                    name, data = next(members, (None, None))
+                if name is None:
+                    break
+                if name not in png_set:
+                    writer.add_bytes(arcname(name), data)
+                    continue
+
+                key, cached = self.lookup_page(data, name in to_watermark, fingerprint) if self.cache \
+                    else (None, None)
+                if cached is not None:
+                    in_flight.append((name, cached, None, key))
                 else:
-                    # Default to the target directory if the first file is at the root
-                    extracted_subdir = target_directory
+                    future = self.pool.submit_page(page_footprint(data, self.config['OUTPUT_HEIGHT']),
+                                                   watermark_and_compress_bytes, data,
+                                                   self.config['WATERMARK_SIZE'], self.config['WATERMARK_FILE'],
+                                                   self.config['WATERMARK_OPACITY'], self.config['OUTPUT_HEIGHT'],
+                                                   self.config['OUTPUT_QUALITY'], name in to_watermark, name,
+                                                   self.resize_first(), self.encoder)
+                    in_flight.append((name, data, future, key))
+                if len(in_flight) >= max_in_flight:
+                    write_oldest()
+
+            while in_flight:
+                write_oldest()
+            # Copied still compressed, without going through the loop above
+            source.copy_raw(writer)
+
+        self.claim(final_zip_path)
+        print(f"Zip file written to: {final_zip_path} "
+              f"({writer.bytes_in / 1024 / 1024:.1f} MB at {writer.throughput():.1f} MB/s)")
+        return final_zip_path
+
+    def report_skipped(self, source):
+        if source.skipped:
+            metrics.inc('members_skipped', len(source.skipped))
+            print(f"Skipped {len(source.skipped)} members of {os.path.basename(source.file_path)} "
+                  f"({sum(member.size for member in source.skipped) / 1024 / 1024:.1f} MB): "
+                  f"{', '.join(member.name for member in source.skipped[:5])}"
+                  f"{', ...' if len(source.skipped) > 5 else ''}")
+
+    def determine_extracted_subdirectory(self, file_path, target_directory, archive=None):
+        """
+        Returns the folder holding the extracted pages: the folder every member is in, or for flat archives
+        the folder named after the archive they were extracted into. archive is the Archive already opened
+        for the extraction; without it the archive headers are read again.
+        """
+        if archive is None:
+            if not file_path.endswith(ARCHIVE_EXTENSIONS):
+                print(f"Unsupported file type: {file_path}")
+                return None
+            with Archive(file_path, self.member_filter) as archive:
+                pass
+        extracted_subdir = archive.page_directory(target_directory) if archive.members else None
 
         # Debug prints
         print("Target Directory:", target_directory)
@@ -134,61 +503,273 @@ class Handler(FileSystemEventHandler):
 
         return extracted_subdir
 
-    def process_extracted_files(self, extracted_subdir, target_directory, file_path):
-        """Process extracted files, apply watermark, compress images, etc."""
-        png_files = [os.path.join(root, file)
-                     for root, dirs, files in os.walk(extracted_subdir)
-                     for file in files if file.lower().endswith('.png')]
-        # Apply watermark and compress images using ThreadPoolExecutor
-        # Sort files if needed
-        # png_files.sort()
-
-        # Ensure PAGE_IGNORE_COUNT is within valid range
-        total_png_count = len(png_files)
-        page_ignore_count = max(0, min(self.config['PAGE_IGNORE_COUNT'], total_png_count))
-
-        # Apply watermark to the appropriate number of files
-        if page_ignore_count > 0:
-            images_to_watermark = png_files[:-page_ignore_count]
-        else:
-            images_to_watermark = png_files
-
-        # Using ThreadPoolExecutor to apply watermark in parallel
-        with ThreadPoolExecutor(max_workers=self.config['MAX_WORKERS']) as executor:
-            watermark_futures = [executor.submit(apply_watermark, image_path, target_directory,
-                                                 self.config['WATERMARK_SIZE'], self.config['WATERMARK_FILE'],
-                                                 self.config['WATERMARK_OPACITY'])
-                                 for image_path in images_to_watermark]
-
-        # Optionally, you can wait for all futures to complete
-        for future in watermark_futures:
-            future.result()
-
-        # Compress all images into JPG format
-        with ThreadPoolExecutor(max_workers=self.config['MAX_WORKERS']) as executor:
-            compress_futures = [executor.submit(compress_image, image_path, self.config['OUTPUT_HEIGHT'],
-                                                self.config['OUTPUT_QUALITY'])
-                                for image_path in png_files]
-        for future in compress_futures:
-            future.result()
-
-        # After processing, move the original .rar file to the parent directory
-        parent_directory = os.path.dirname(target_directory)
-        new_location = os.path.join(parent_directory, os.path.basename(file_path))
-        shutil.move(file_path, new_location)
-        print(f"Original file moved to: {new_location}")
+    def process_extracted_files(self, extracted_subdir, target_directory, file_path, job=None, source=None,
+                                work_directory=None, extraction=None, on_output=None):
+        """
+        Process extracted files, apply watermark, compress images, etc.
+        source is the Archive the files were extracted from (its index gives the pages in reading order), it is
+        read again when not given. For a dropped folder, source is the Folder and the pages are its own files.
+        work_directory is the folder the archive was extracted into (WORK_DIR, by default target_directory).
+        job is the journal entry of an interrupted run; only the pages it has not finished are processed again.
+        extraction is the Extraction of source still running, if any: pages are only read once they are on disk,
+        and the archive is journaled 'extracted' once every member is.
+        on_output(output zip) runs once the output is written, before the original is moved.
+        """
+        archive = os.path.basename(file_path)
+        if source is None:
+            with open_source(file_path, self.member_filter) as source:
+                pass
+        work_directory = work_directory or (job or {}).get('work_directory') or target_directory
+        extraction_root = source.extraction_root(work_directory)
+        # A folder has no intermediate PNG to spare and no original to restore pages from: always fused
+        legacy = self.config.get('PIPELINE_MODE', 'fused') == 'legacy' and not source.is_folder
+        if job is None:
+            png_files = [os.path.join(extraction_root, *name.split('/')) for name in source.pages]
+
+            # Ensure PAGE_IGNORE_COUNT is within valid range
+            total_png_count = len(png_files)
+            page_ignore_count = max(0, min(self.config['PAGE_IGNORE_COUNT'], total_png_count))
+
+            # Apply watermark to the appropriate number of files
+            if page_ignore_count > 0:
+                images_to_watermark = png_files[:-page_ignore_count]
+            else:
+                images_to_watermark = png_files
 
-        # Determine the final destination directory for the zip file (outside _target_)
-        final_zip_directory = ""  # Replace with your desired path (!Not used at the moment)
+            if self.journal:
+                self.journal.record(file_path, 'planned', extracted_subdir=extracted_subdir, pages=png_files,
+                                    watermark=images_to_watermark, work_directory=work_directory)
+        else:
+            # An extraction cut short by the crash ('planned', not 'extracted') may have left pages missing or
+            # truncated: every page that is not done is extracted again, with the pass-through members
+            extracting = job['state'] == 'planned' and not source.is_folder
+            png_files = [page for page in job['pages']
+                         if page not in job['done'] and (extracting or os.path.exists(page))]
+            remaining = set(png_files)
+            images_to_watermark = [page for page in job['watermark'] if page in remaining]
+            # Pages overwritten in place (every page in legacy mode, JPEG pages in fused mode) may already be
+            # processed: restore the originals so no page is watermarked twice. A folder's pages cannot be
+            # restored, their records are synced instead (see watermark_and_compress)
+            restore = [page for page in png_files if extracting or legacy or is_replaced_in_place(page)]
+            if (restore or extracting) and not source.is_folder:
+                names = [os.path.relpath(page, extraction_root).replace(os.sep, '/') for page in restore]
+                if extracting:
+                    names += [name for name in source.extract_names if name not in source.pages]
+                with Archive(file_path, self.member_filter) as reopened:
+                    reopened.extract(work_directory, names)
+                if extracting and self.journal:
+                    self.journal.record(file_path, 'extracted')
+
+        if legacy and extraction:
+            self.finish_extraction(extraction, source, file_path)
+            extraction = None
+        if legacy:
+            self.watermark_then_compress(png_files, images_to_watermark, target_directory, file_path)
+        else:
+            self.watermark_and_compress(png_files, images_to_watermark, archive, file_path,
+                                        extraction and extraction.wait)
+        if extraction:
+            self.finish_extraction(extraction, source, file_path)  # pass-through members too, before zipping
+        if self.pool.backend == 'thread':
+            # Process workers keep their own caches
+            print(f"Watermark cache: {watermark_cache_info()}")
+
+        # The zip file goes next to the original archive's folder (outside _target_), wherever it was extracted
+        final_zip_directory = os.path.dirname(target_directory)
         zip_name = os.path.basename(extracted_subdir)  # Example: use the name of the extracted folder
         # print(f"zip_name: {zip_name}")
+        final_zip_path = os.path.join(final_zip_directory, f"{zip_name}.zip")
+        self.claim(final_zip_path, final_zip_path + '.part')
 
         # Call the function to compress and move the folder
-        compress_and_move_folder(extracted_subdir, final_zip_directory, zip_name)
+        with metrics.span('zip', archive=archive):
+            final_zip_path = compress_and_move_folder(extracted_subdir, final_zip_directory, zip_name,
+                                                      self.config.get('ZIP_MODE', 'auto'), self.pool.io,
+                                                      add_members=source.copy_raw,
+                                                      exclude={source.path(member.name) for member in source.skipped}
+                                                      if source.is_folder else ())
+        if final_zip_path is None:
+            return None
+        self.claim(final_zip_path)
+        if self.journal:
+            self.journal.record(file_path, 'zipped', zip=final_zip_path)
+        if on_output:
+            on_output(final_zip_path)
+
+        # After zipping, move the original file to the parent directory (a dropped folder was zipped itself)
+        if not source.is_folder:
+            with metrics.span('move', archive=archive):
+                self.move_original_file(file_path, target_directory, final_zip_path)
+        return final_zip_path
+
+    def finish_extraction(self, extraction, source, file_path):
+        """Waits until every member of the extraction is on disk, then journals the archive as 'extracted'."""
+        extraction.wait()
+        source.close()  # the original archive is moved later, which fails on Windows while it is open
+        if self.journal:
+            self.journal.record(file_path, 'extracted')
+
+    def watermark_and_compress(self, png_files, images_to_watermark, archive='', file_path=None, extracted=None):
+        """
+        Fused mode: every page is decoded, watermarked, resized and encoded as JPEG in a single pass.
+        extracted(page), if given, waits until a page of an extraction still running is on disk: the pages go to
+        the page stage as they come out of the archive.
+        """
+        to_watermark = set(images_to_watermark)
+        fingerprint = self.cache.fingerprint(self.config) if self.cache else None
+        # Pages of a dropped folder replaced in place cannot be restored on resume, so their records must not be lost
+        folder = file_path is not None and os.path.isdir(file_path)
+        # Past the first SHARD_PAGES pages, the pages are handed out to the other workers of the spool
+        shard_pages = self.config.get('SHARD_PAGES', 0) if self.spool else 0
+        futures, shards, chunk = [], [], []
+        for image_path in png_files:
+            if extracted:
+                extracted(image_path)
+            watermark = image_path in to_watermark
+            key = None
+            if self.cache:
+                with open(image_path, 'rb') as f:
+                    key, cached = self.lookup_page(f.read(), watermark, fingerprint)
+                if cached is not None:
+                    output_path = jpeg_output_path(image_path)
+                    with open(output_path + '.tmp', 'wb') as f:
+                        f.write(cached)
+                    finish_page(image_path, output_path)
+                    metrics.inc('pages', archive=archive)
+                    if self.journal and file_path:
+                        self.journal.page_done(file_path, image_path, sync=folder and is_replaced_in_place(image_path))
+                    continue
+
+            if shard_pages and len(futures) >= shard_pages:
+                chunk.append((image_path, key, watermark))
+                if len(chunk) == shard_pages:
+                    shards.append((chunk, self.spool.publish_shard([(page, mark) for page, _, mark in chunk])))
+                    chunk = []
+                continue
+            futures.append((image_path, key, self.pool.submit_page(
+                page_footprint(image_path, self.config['OUTPUT_HEIGHT']),
+                watermark_and_compress, image_path, self.config['WATERMARK_SIZE'], self.config['WATERMARK_FILE'],
+                self.config['WATERMARK_OPACITY'], self.config['OUTPUT_HEIGHT'], self.config['OUTPUT_QUALITY'],
+                watermark, self.resize_first(), self.encoder)))
+        if chunk:
+            shards.append((chunk, self.spool.publish_shard([(page, mark) for page, _, mark in chunk])))
+
+        for image_path, key, future in futures:
+            self.page_finished(image_path, key, future.result(), archive, file_path, folder)
+        for chunk, shard in shards:
+            stats = self.spool.collect_shard(shard, [(page, watermark) for page, key, watermark in chunk])
+            for (image_path, key, watermark), page_stats in zip(chunk, stats):
+                self.page_finished(image_path, key, page_stats, archive, file_path, folder)
+
+    def page_finished(self, image_path, key, stats, archive, file_path, folder):
+        """Records a page processed by watermark_and_compress (stats is None when it failed)."""
+        self.record_page(stats, archive)
+        if stats and self.journal and file_path:
+            self.journal.page_done(file_path, image_path, sync=folder and is_replaced_in_place(image_path))
+        if key and stats:
+            with open(jpeg_output_path(image_path), 'rb') as f:
+                self.cache.put_page(key, f.read())
+
+    def process_shard(self, pages, output_directory):
+        """
+        Processes a shard of pages published by another worker (see Spool.publish_shard()), writing the JPEGs
+        into output_directory and leaving the pages themselves untouched. Returns the stats of every page.
+        """
+        futures = []
+        for page, watermark in pages:
+            with open(page, 'rb') as f:
+                data = f.read()
+            futures.append((page, self.pool.submit_page(
+                page_footprint(data, self.config['OUTPUT_HEIGHT']), watermark_and_compress_bytes, data,
+                self.config['WATERMARK_SIZE'], self.config['WATERMARK_FILE'], self.config['WATERMARK_OPACITY'],
+                self.config['OUTPUT_HEIGHT'], self.config['OUTPUT_QUALITY'], watermark, page, self.resize_first(),
+                self.encoder)))
+        results = []
+        for page, future in futures:
+            output, stats = future.result()
+            if output is not None:
+                output_path = os.path.join(output_directory, os.path.basename(jpeg_output_path(page)))
+                with open(output_path + '.tmp', 'wb') as f:
+                    f.write(output)
+                os.replace(output_path + '.tmp', output_path)
+            results.append(stats)
+        return results
+
+    def resize_first(self):
+        """Whether the fused page stage resizes pages before watermarking them (WATERMARK_ORDER)."""
+        order = self.config.get('WATERMARK_ORDER', 'watermark_first')
+        if order not in ('watermark_first', 'resize_first'):
+            raise ValueError(f"Unknown WATERMARK_ORDER: {order}")
+        return order == 'resize_first'
+
+    def lookup_page(self, data, watermark, fingerprint):
+        """Returns the result cache key of a source page and the cached JPEG bytes (None on a miss)."""
+        key = self.cache.page_key(data, fingerprint, watermark)
+        cached = self.cache.get_page(key)
+        if cached is not None:
+            metrics.inc('cache_hits')
+        return key, cached
+
+    def record_page(self, stats, archive):
+        """Records the stats returned by the page stages in utils (None when the page failed)."""
+        if stats is None:
+            self.page_failed(archive)
+            return
+        metrics.inc('pages', archive=archive)
+        metrics.inc('bytes_in', stats.pop('bytes_in'))
+        metrics.inc('bytes_out', stats.pop('bytes_out'))
+        metrics.inc('encode_attempts', stats.pop('encode_attempts', 1))
+        metrics.record_spans(stats, archive=archive)
+
+    def page_failed(self, archive):
+        """Counts a failed page, also for the job running on this thread (see process_archive_cached())."""
+        metrics.inc('errors', archive=archive)
+        self.job_failures.pages = getattr(self.job_failures, 'pages', 0) + 1
+
+    def watermark_then_compress(self, png_files, images_to_watermark, target_directory, file_path=None):
+        """Legacy mode: watermark every page back to PNG, then compress all pages into JPEG in a second pass."""
+        # Apply the watermark in parallel
+        # apply_watermark decodes the page at full size
+        watermark_futures = [self.pool.submit_page(page_footprint(image_path, self.config['OUTPUT_HEIGHT'], False),
+                                                   apply_watermark, image_path, target_directory,
+                                                   self.config['WATERMARK_SIZE'], self.config['WATERMARK_FILE'],
+                                                   self.config['WATERMARK_OPACITY'])
+                             for image_path in images_to_watermark]
+        archive = os.path.basename(file_path or '')
+        for future in watermark_futures:
+            if future.result() is False:
+                self.page_failed(archive)
 
-    def move_original_file(self, file_path, target_directory):
-        """Move the original RAR file after processing."""
+        # Compress all images into JPG format
+        compress_futures = [self.pool.submit_page(page_footprint(image_path, self.config['OUTPUT_HEIGHT']),
+                                                  compress_image, image_path, self.config['OUTPUT_HEIGHT'],
+                                                  self.config['OUTPUT_QUALITY'], self.encoder)
+                            for image_path in png_files]
+        for future in compress_futures:
+            if future.result() is False:
+                self.page_failed(archive)
+        metrics.inc('pages', len(png_files))
+        if self.journal and file_path:
+            for image_path in png_files:
+                if not os.path.exists(image_path):
+                    self.journal.page_done(file_path, image_path)
+
+    def move_original_file(self, file_path, target_directory, output_path=None):
+        """
+        Move the original archive file (with all its volumes, or the streamed folder) after processing.
+        An original with the name of the output zip (output_path, e.g. 'Chapter 1.zip' holding 'Chapter 1/') is
+        replaced by the output: it is deleted instead of being moved over it.
+        """
         parent_directory = os.path.dirname(target_directory)
-        new_location = os.path.join(parent_directory, os.path.basename(file_path))
-        shutil.move(file_path, new_location)
-        print(f"Original .rar file moved to: {new_location}")
+        for volume in volume_paths(file_path):
+            new_location = os.path.join(parent_directory, os.path.basename(volume))
+            if output_path and os.path.normcase(os.path.abspath(new_location)) == \
+                    os.path.normcase(os.path.abspath(output_path)):
+                os.remove(volume)
+                print(f"Original file replaced by the output: {new_location}")
+                continue
+            # An archive from a sub folder of _target_ is moved within it, it must not be picked up again
+            self.claim(new_location)
+            shutil.move(volume, new_location)
+            self.claim(new_location)
+            print(f"Original file moved to: {new_location}")
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+
+
+class Journal:
+    """
+    Append-only JSON-lines journal of the archive (and dropped folder) jobs, used to resume them after a crash.
+
+    Each line is a state transition of an archive ('started', 'planned', 'extracted', 'zipped', 'finished',
+    'failed') or of one of its pages ('page_done'). An archive is 'planned' while it is still being extracted in the
+    background and 'extracted' once every member is on disk. On load, finished jobs are dropped and the file is
+    compacted to the jobs that are still unfinished.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = {}  # archive path -> {'state', 'extracted_subdir', 'pages', 'watermark', 'done'}
+        if os.path.exists(path):
+            self.load()
+        self.compact()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    self.apply(json.loads(line))
+                except ValueError:
+                    pass  # a line cut short by a crash
+
+    def apply(self, entry):
+        archive, state = entry['archive'], entry['state']
+        if state in ('finished', 'failed'):
+            self.jobs.pop(archive, None)
+            return
+        job = self.jobs.setdefault(archive, {'state': 'started', 'done': set()})
+        if state == 'started':
+            job.clear()
+            job.update(state='started', done=set())
+        elif state == 'page_done':
+            job['done'].add(entry['page'])
+            return
+        job['state'] = state
+        for key, value in entry.items():
+            if key not in ('archive', 'state'):
+                job[key] = value
+
+    def compact(self):
+        """Rewrites the journal with only the unfinished jobs."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for archive, job in self.jobs.items():
+                fields = {key: value for key, value in job.items() if key != 'done'}
+                f.write(json.dumps({'archive': archive, **fields}, ensure_ascii=False) + '\n')
+                for page in sorted(job['done']):
+                    f.write(json.dumps({'archive': archive, 'state': 'page_done', 'page': page},
+                                       ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def record(self, archive, state, sync=True, **fields):
+        entry = {'archive': archive, 'state': state, **fields}
+        with self.lock:
+            self.apply(entry)
+            self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def page_done(self, archive, page, sync=False):
+        # Not synced by default: a lost page record only means that page is checked again on resume
+        self.record(archive, 'page_done', sync=sync, page=page)
+
+    def get(self, archive):
+        with self.lock:
+            job = self.jobs.get(archive)
+            return dict(job, done=set(job['done'])) if job else None
+
+    def unfinished(self):
+        with self.lock:
+            return list(self.jobs)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
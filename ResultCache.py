@@ -0,0 +1,164 @@
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+
+# Bump when the page pipeline changes its output, so that old entries are no longer used
+CACHE_VERSION = 1
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk, content-addressed cache of finished results.
+
+    - pages: JPEG bytes keyed by the hash of the source page plus the config fingerprint
+    - archives: the finished output zip keyed by the hash of the input archive plus the config fingerprint
+
+    Entries are evicted least recently used first (by mtime, refreshed on every hit) once the cache grows
+    beyond max_mb.
+    """
+
+    def __init__(self, directory, max_mb=1024):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.counters = {'page_hits': 0, 'page_misses': 0, 'archive_hits': 0, 'archive_misses': 0}
+        self.watermark_hashes = {}  # (path, mtime) -> sha256 of the watermark file
+        os.makedirs(os.path.join(directory, 'pages'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'archives'), exist_ok=True)
+        self.size = sum(entry[2] for entry in self.entries())
+
+    def fingerprint(self, config, *extra):
+        """Hash of every setting that changes the output (the watermark by content, not by path)."""
+        from encoder import settings_from_config
+        path = os.path.abspath(config['WATERMARK_FILE'])
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            watermark_hash = self.watermark_hashes.get((path, mtime))
+        if watermark_hash is None:
+            watermark_hash = file_sha256(path)
+            with self.lock:
+                self.watermark_hashes[(path, mtime)] = watermark_hash
+        parts = (CACHE_VERSION, watermark_hash, config['WATERMARK_SIZE'], config['WATERMARK_OPACITY'],
+                 config['OUTPUT_HEIGHT'], config['OUTPUT_QUALITY'], config.get('WATERMARK_ORDER', 'watermark_first'),
+                 settings_from_config(config)) + extra
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def page_key(data, fingerprint, watermark):
+        digest = hashlib.sha256(data)
+        digest.update(f"|{fingerprint}|{watermark}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def page_path(self, key):
+        return os.path.join(self.directory, 'pages', key[:2], key + '.jpg')
+
+    def get_page(self, key):
+        path = self.page_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            self.count('page_misses')
+            return None
+        self.count('page_hits')
+        return data
+
+    def put_page(self, key, data):
+        path = self.page_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write(path, data)
+
+    def get_archive(self, key):
+        """Returns the path of the cached output zip, or None."""
+        folder = os.path.join(self.directory, 'archives', key)
+        try:
+            zip_path = os.path.join(folder, next(f for f in os.listdir(folder) if f.endswith('.zip')))
+            os.utime(zip_path)
+        except (OSError, StopIteration):
+            self.count('archive_misses')
+            return None
+        self.count('archive_hits')
+        return zip_path
+
+    def put_archive(self, key, zip_path):
+        """Copies the output zip into the cache (file to file, it is never read into memory)."""
+        folder = os.path.join(self.directory, 'archives', key)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, os.path.basename(zip_path))
+        temp_path = self._temp_path(path)
+        shutil.copyfile(zip_path, temp_path)
+        self._commit(temp_path, path)
+
+    def _write(self, path, data):
+        temp_path = self._temp_path(path)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        self._commit(temp_path, path)
+
+    @staticmethod
+    def _temp_path(path):
+        # Written under a unique temporary name first, so readers never see a partial entry
+        return f"{path}.{uuid.uuid4().hex}.tmp"
+
+    def _commit(self, temp_path, path):
+        size = os.path.getsize(temp_path)
+        existed = os.path.exists(path)
+        os.replace(temp_path, path)
+        if not existed:
+            with self.lock:
+                self.size += size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def entries(self):
+        """Yields (mtime, path, size) of every cached file."""
+        for root, dirs, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache is back to 90% of its maximum size."""
+        with self.lock:
+            entries = sorted(self.entries())
+            self.size = sum(entry[2] for entry in entries)
+            for mtime, path, size in entries:
+                if self.size <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.size -= size
+                folder = os.path.dirname(path)
+                if os.path.dirname(folder) == os.path.join(self.directory, 'archives'):
+                    shutil.rmtree(folder, ignore_errors=True)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, size_mb=round(self.size / 1024 / 1024, 1))
+        for kind in ('page', 'archive'):
+            lookups = stats[f'{kind}_hits'] + stats[f'{kind}_misses']
+            stats[f'{kind}_hit_rate'] = round(stats[f'{kind}_hits'] / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,149 @@
+import os
+import queue
+import threading
+import time
+
+from archives import volume_paths
+from metrics import metrics
+
+
+def job_size(path):
+    """
+    Size of an archive (all volumes of a volume set), or total size of the files in a dropped folder, in bytes
+    (0 if it cannot be read).
+    """
+    try:
+        if not os.path.isdir(path):
+            return sum(os.path.getsize(volume) for volume in volume_paths(path))
+        return sum(os.path.getsize(os.path.join(root, file)) for root, dirs, files in os.walk(path) for file in files)
+    except OSError:
+        return 0
+
+
+class MemoryBudget:
+    """
+    Counts reserved bytes against a fixed budget. acquire() blocks until the reservation fits, except when
+    nothing is reserved at all, so a single job larger than the whole budget can still run on its own.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, amount):
+        with self.condition:
+            while self.used and self.used + amount > self.budget:
+                self.condition.wait()
+            self.used += amount
+
+    def release(self, amount):
+        with self.condition:
+            self.used -= amount
+            self.condition.notify_all()
+
+
+class Scheduler:
+    """
+    Runs archive jobs off the observer thread.
+
+    Jobs wait in a bounded queue (submit() blocks when it is full) and up to max_concurrent archives are
+    processed at the same time. Their pages are all submitted to the same worker pool, so work from different
+    archives is interleaved. Each job reserves its archive (or folder) size from the memory budget before it
+    starts. The time from submit() until the job starts, in the queue and on the budget, is the 'queue_wait' span.
+    Jobs writing the same output (see start()) never run at the same time.
+    """
+
+    def __init__(self, max_concurrent=2, queue_size=64, memory_budget_mb=2048):
+        self.process_job = None
+        self.jobs = queue.Queue(maxsize=max(1, queue_size))
+        self.memory = MemoryBudget(memory_budget_mb * 1024 * 1024)
+        self.known = {}  # queued or running path -> time it was submitted, to drop duplicates
+        self.running_jobs = set()
+        self.outputs = set()  # output paths of the running jobs
+        self.output_of = None
+        self.lock = threading.Lock()
+        self.output_released = threading.Condition(self.lock)
+        self.workers = [threading.Thread(target=self.run, daemon=True) for _ in range(max(1, max_concurrent))]
+        self.completed = 0
+
+    def start(self, process_job, output_of=None):
+        """
+        output_of(path), if given, returns the path of the output a job writes (or None): jobs with the same output
+        run one after the other, so they never write the same files at once.
+        """
+        self.process_job = process_job
+        self.output_of = output_of
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, path):
+        """Queues path, blocking while the queue is full. Returns False if path is already queued or running."""
+        with self.lock:
+            if path in self.known:
+                return False
+            self.known[path] = time.monotonic()
+        self.jobs.put(path)
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {'queued': self.jobs.qsize(), 'running': len(self.running_jobs), 'completed': self.completed,
+                    'memory_reserved_mb': round(self.memory.used / 1024 / 1024, 1)}
+
+    def idle(self):
+        """Whether no job is queued or running."""
+        with self.lock:
+            return not self.known
+
+    def stop(self, drain=True):
+        """
+        Stops the workers. Jobs already running always finish. With drain=True the queued jobs are processed
+        first; otherwise they are left untouched in the watched folder and returned (Handler.stop() journals them).
+        """
+        skipped = []
+        if not drain:
+            while True:
+                try:
+                    skipped.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.join()
+        if skipped:
+            print(f"Left unprocessed: {skipped}")
+        return skipped
+
+    def run(self):
+        while True:
+            path = self.jobs.get()
+            if path is None:
+                return
+
+            output = self.output_of(path) if self.output_of else None
+            with self.output_released:
+                while output in self.outputs:
+                    self.output_released.wait()
+                if output:
+                    self.outputs.add(output)
+            estimate = job_size(path)
+            self.memory.acquire(estimate)
+            with self.lock:
+                self.running_jobs.add(path)
+                waited = time.monotonic() - self.known[path]
+            metrics.record_span('queue_wait', waited, archive=os.path.basename(path))
+            try:
+                self.process_job(path)
+            except Exception as e:
+                print(f"Error in processing {path}: {e}")
+            finally:
+                self.memory.release(estimate)
+                with self.output_released:
+                    self.running_jobs.discard(path)
+                    self.known.pop(path, None)
+                    self.outputs.discard(output)
+                    self.output_released.notify_all()
+                    self.completed += 1
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from metrics import metrics
+from utils import finish_page, jpeg_output_path
+
+# Idle workers look for page shards this often
+SHARD_POLL_SECONDS = 0.5
+
+
+class Spool:
+    """
+    Coordinates several workers (Watcher or batch.py processes, on one or several hosts) sharing the same watched
+    folder through a shared spool directory, without any broker:
+
+    - workers/<id>.json: heartbeat of every worker, rewritten every HEARTBEAT_SECONDS
+    - claims/<key>.json: the archive (or folder) a worker is processing, created with O_EXCL so that exactly one
+      worker gets it. Paths are stored relative to the watched folder, which may be mounted elsewhere on each host.
+    - shards/<id>/: pages of a large archive handed out to other workers (see publish_shard()), with the 'claim'
+      of the worker processing them, the JPEGs it wrote into 'out' and its 'result.json'
+
+    A worker is dead once its heartbeat has not changed for WORKER_TIMEOUT_SECONDS, as seen by the local clock of
+    the worker looking at it (the clocks of the hosts are never compared). The claims and shards of dead workers
+    are broken by the first live worker that notices: the archive is queued again through on_reclaim, the shard
+    is processed again by whoever claims it next.
+    """
+
+    def __init__(self, directory, root, worker_id='', heartbeat_seconds=5.0, timeout_seconds=30.0,
+                 on_reclaim=None, process_shard=None, shard_timeout_seconds=600.0):
+        self.directory = os.path.abspath(directory)
+        self.root = os.path.abspath(root)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat_seconds = heartbeat_seconds
+        self.timeout_seconds = timeout_seconds
+        self.on_reclaim = on_reclaim
+        self.process_shard = process_shard
+        self.shard_timeout_seconds = shard_timeout_seconds
+        for name in ('workers', 'claims', 'shards'):
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.held = {}  # claim key -> number of nested claims
+        self.heartbeats = {}  # worker -> (last heartbeat seen, time.monotonic() when it changed)
+        self.beat = 0
+        self.stopping = threading.Event()
+        self.threads = [threading.Thread(target=self.run, daemon=True)]
+        if process_shard:
+            self.threads.append(threading.Thread(target=self.run_shards, daemon=True))
+
+    def start(self):
+        self.heartbeat()
+        for thread in self.threads:
+            thread.start()
+        print(f"Spool: {self.directory} as worker {self.worker_id}")
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
+        try:
+            os.remove(self.worker_path(self.worker_id))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        counters = metrics.snapshot()['counters']
+        return {name: counters.get(name, 0) for name in ('jobs_claimed', 'jobs_skipped', 'jobs_reclaimed',
+                                                         'shards_published', 'shards_processed', 'shards_reclaimed')}
+
+    def run(self):
+        while not self.stopping.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+                self.sweep()
+            except OSError as e:
+                print(f"Error in the spool heartbeat: {e}")
+
+    def worker_path(self, worker):
+        return os.path.join(self.directory, 'workers', f"{worker}.json")
+
+    def heartbeat(self):
+        self.beat += 1
+        write_json(self.worker_path(self.worker_id),
+                   {'beat': self.beat, 'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time()})
+
+    def is_alive(self, worker):
+        """Whether the heartbeat of worker changed during the last timeout_seconds (a new worker gets that long)."""
+        if worker == self.worker_id:
+            return True
+        beat = read_json(self.worker_path(worker))
+        beat = beat and beat.get('beat')
+        now = time.monotonic()
+        with self.lock:
+            seen = self.heartbeats.get(worker)
+            if seen is None or seen[0] != beat:
+                self.heartbeats[worker] = (beat, now)
+                return True
+            return now - seen[1] < self.timeout_seconds
+
+    # Archive claims
+
+    def relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+
+    def claim_path(self, path):
+        key = hashlib.sha1(self.relative(path).encode('utf-8')).hexdigest()
+        return key, os.path.join(self.directory, 'claims', f"{key}.json")
+
+    def claim(self, path, job=True):
+        """
+        Claims path for this worker. Returns False if another worker holds it. Claims are reentrant, every
+        successful claim() must be followed by a release(). job=False marks a claim that only keeps other workers
+        away (e.g. an extracted folder): it is not queued again when this worker dies.
+        """
+        key, claim_path = self.claim_path(path)
+        with self.lock:
+            if key in self.held:
+                self.held[key] += 1
+                return True
+            if not create_json(claim_path, {'worker': self.worker_id, 'path': self.relative(path), 'job': job}):
+                holder = read_json(claim_path)
+                if not holder or holder.get('worker') != self.worker_id:
+                    return False
+                # Left behind by an earlier run under the same WORKER_ID
+            self.held[key] = 1
+            return True
+
+    def release(self, path):
+        key, claim_path = self.claim_path(path)
+        with self.lock:
+            self.held[key] -= 1
+            if self.held[key]:
+                return
+            del self.held[key]
+            try:
+                os.remove(claim_path)
+            except FileNotFoundError:
+                pass
+
+    def holder(self, path):
+        """Returns the worker holding path, or None."""
+        holder = read_json(self.claim_path(path)[1])
+        return holder and holder.get('worker')
+
+    def held_elsewhere(self, paths):
+        """Whether another worker holds any of paths (claims of dead workers are broken by sweep())."""
+        return any(self.holder(path) not in (None, self.worker_id) for path in paths)
+
+    def break_claim(self, claim_path, worker):
+        """
+        Removes the claim of the dead worker. Returns False if another worker broke it first (a claim made since
+        then by a live worker is put back).
+        """
+        stale_path = f"{claim_path}.stale-{self.worker_id}"
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            return False
+        holder = read_json(stale_path)
+        broken = holder is not None and holder.get('worker') == worker
+        if not broken:
+            try:
+                os.link(stale_path, claim_path)
+            except FileExistsError:
+                pass
+        os.remove(stale_path)
+        return broken
+
+    def sweep(self):
+        """Breaks the claims and shards of dead workers."""
+        claims = os.path.join(self.directory, 'claims')
+        for entry in os.scandir(claims):
+            if not entry.name.endswith('.json'):
+                continue
+            holder = read_json(entry.path)
+            if not holder:
+                continue
+            with self.lock:
+                ours = holder['worker'] == self.worker_id and entry.name[:-5] in self.held
+            if ours or self.is_alive(holder['worker']) and holder['worker'] != self.worker_id:
+                continue
+            if self.break_claim(entry.path, holder['worker']):
+                path = os.path.join(self.root, *holder['path'].split('/'))
+                print(f"Reclaimed {path} from worker {holder['worker']}")
+                metrics.inc('jobs_reclaimed')
+                if holder.get('job', True) and os.path.exists(path) and self.on_reclaim:
+                    self.on_reclaim(path)
+
+        for shard in self.list_shards():
+            header = read_json(os.path.join(shard, 'shard.json'))
+            if not header:
+                continue
+            if not self.is_alive(header['owner']):
+                # Nobody waits for the pages of a dead owner any more, its archive is reclaimed as a whole
+                shutil.rmtree(shard, ignore_errors=True)
+                continue
+            holder = read_json(os.path.join(shard, 'claim'))
+            if holder and not os.path.exists(os.path.join(shard, 'result.json')) \
+                    and not self.is_alive(holder['worker']):
+                if self.break_claim(os.path.join(shard, 'claim'), holder['worker']):
+                    print(f"Reclaimed shard {os.path.basename(shard)} from worker {holder['worker']}")
+                    metrics.inc('shards_reclaimed')
+
+    # Page shards
+
+    def list_shards(self):
+        shards = os.path.join(self.directory, 'shards')
+        return [entry.path for entry in os.scandir(shards) if entry.is_dir() and not entry.name.startswith('.')]
+
+    def publish_shard(self, pages):
+        """
+        Copies pages (a list of (page path, watermark)) into a new shard any worker can process. The shard only
+        appears once all its pages are copied. Returns the shard directory, see collect_shard().
+        """
+        shard_id = f"{self.worker_id}-{uuid.uuid4().hex[:12]}"
+        temp = os.path.join(self.directory, 'shards', f".{shard_id}")
+        os.makedirs(temp)
+        names = []
+        for index, (page, watermark) in enumerate(pages):
+            name = f"{index:04d}{os.path.splitext(page)[1].lower()}"
+            shutil.copyfile(page, os.path.join(temp, name))
+            names.append((name, watermark))
+        write_json(os.path.join(temp, 'shard.json'), {'owner': self.worker_id, 'pages': names})
+        shard = os.path.join(self.directory, 'shards', shard_id)
+        os.rename(temp, shard)
+        metrics.inc('shards_published')
+        return shard
+
+    def run_shards(self):
+        while not self.stopping.is_set():
+            if not self.process_next_shard():
+                self.stopping.wait(SHARD_POLL_SECONDS)
+
+    def process_next_shard(self):
+        """Claims and processes one pending shard. Returns False if there was none."""
+        return any(self.take_shard(shard) for shard in self.list_shards())
+
+    def take_shard(self, shard):
+        """
+        Claims and processes shard, unless another worker has. Returns whether it was taken. A shard that fails gets
+        a result without any page (its pages are left as they are by the owner); if even that cannot be written,
+        the claim is given up for another worker to try.
+        """
+        claim_path, result_path = os.path.join(shard, 'claim'), os.path.join(shard, 'result.json')
+        if os.path.exists(claim_path) or os.path.exists(result_path):
+            return False
+        header = None
+        try:
+            if not create_json(claim_path, {'worker': self.worker_id}):
+                return False
+            header = read_json(os.path.join(shard, 'shard.json'))
+            if header is None:
+                return False
+            # The pages are never modified, so a shard taken over from a dead worker is processed from scratch
+            output_directory = os.path.join(shard, 'out')
+            os.makedirs(output_directory, exist_ok=True)
+            stats = self.process_shard([(os.path.join(shard, name), watermark)
+                                        for name, watermark in header['pages']], output_directory)
+            write_json(result_path, {'worker': self.worker_id, 'stats': stats})
+        except FileNotFoundError:
+            return False  # removed by its owner's sweep or by the owner itself
+        except Exception as e:
+            metrics.inc('errors')
+            print(f"Error in processing shard {os.path.basename(shard)}: {e}")
+            try:
+                write_json(result_path, {'worker': self.worker_id, 'stats': [None] * len(header['pages']),
+                                         'error': str(e)})
+            except Exception:
+                try:
+                    os.remove(claim_path)
+                except OSError:
+                    pass
+            return True
+        metrics.inc('shards_processed')
+        return True
+
+    def collect_shard(self, shard, pages):
+        """
+        Waits for the result of a shard published with pages, moves the JPEGs back next to the pages (replacing
+        them like the local page stage does) and removes the shard. Returns the stats of every page in order
+        (None for a page that failed, which is left as it is).
+
+        Past shard_timeout_seconds, or once the spool is stopping, a shard nobody has taken yet is processed
+        here; the pages of a shard still held by another worker then fail.
+        """
+        result_path = os.path.join(shard, 'result.json')
+        deadline = time.monotonic() + self.shard_timeout_seconds
+        while not os.path.exists(result_path):
+            if self.stopping.is_set() or time.monotonic() > deadline:
+                self.take_shard(shard)
+                break
+            # The heartbeat thread breaks the claim of a dead worker, any live worker then takes the shard over
+            time.sleep(SHARD_POLL_SECONDS)
+        result = read_json(result_path)
+        if result is None:
+            print(f"Gave up waiting for shard {os.path.basename(shard)}, held by worker "
+                  f"{(read_json(os.path.join(shard, 'claim')) or {}).get('worker')}")
+            shutil.rmtree(shard, ignore_errors=True)
+            return [None] * len(pages)
+        names = [name for name, watermark in read_json(os.path.join(shard, 'shard.json'))['pages']]
+        for (page, watermark), name, stats in zip(pages, names, result['stats']):
+            if stats is None:
+                continue
+            output_path = jpeg_output_path(page)
+            shutil.move(jpeg_output_path(os.path.join(shard, 'out', name)), output_path + '.tmp')
+            finish_page(page, output_path)
+        shutil.rmtree(shard, ignore_errors=True)
+        return result['stats']
+
+
+def create_json(path, data):
+    """Atomically creates path with data, returns False if it already exists."""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    return True
+
+
+def write_json(path, data):
+    """Replaces path with data, readers never see a partial file."""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def read_json(path):
+    """Returns the JSON object in path, or None if it is missing or still being written."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from Scheduler import MemoryBudget
+from utils import get_watermark
+
+
+def _warm_up(watermark_file, watermark_width, watermark_opacity):
+    """Builds the prepared watermark once per worker so the first pages don't pay for it."""
+    try:
+        get_watermark(watermark_file, watermark_width, watermark_opacity)
+    except Exception as e:
+        print(f"Error in preparing the watermark {watermark_file}: {e}")
+
+
+class WorkerPool:
+    """
+    Persistent executors shared by every archive processed by a Watcher.
+
+    - cpu: decode/watermark/resize/encode work, as threads or processes depending on EXECUTOR_BACKEND
+    - io: file and archive work that mostly waits on the disk
+
+    Page stages go through submit_page(), which admits them against PIXEL_BUDGET_MB: the decoded pixels held
+    by all image workers together, estimated from each page header (utils.page_footprint) before it is decoded.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.cpu_workers = max(1, config.get('CPU_WORKERS') or os.cpu_count() or 1)
+        self.io_workers = max(1, config.get('MAX_WORKERS') or self.cpu_workers)
+        self.backend = config.get('EXECUTOR_BACKEND', 'auto')
+        if self.backend == 'auto':
+            self.backend = 'process' if self.cpu_workers > 1 else 'thread'
+        if self.backend not in ('thread', 'process'):
+            raise ValueError(f"Unknown EXECUTOR_BACKEND: {self.backend}")
+
+        warm_up_args = (config['WATERMARK_FILE'], config['WATERMARK_SIZE'], config['WATERMARK_OPACITY'])
+        if self.backend == 'process':
+            from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing, only when used
+            self.cpu = ProcessPoolExecutor(max_workers=self.cpu_workers, initializer=_warm_up,
+                                           initargs=warm_up_args)
+        else:
+            # Threads share the process-wide watermark cache, so warming it up once is enough
+            _warm_up(*warm_up_args)
+            self.cpu = ThreadPoolExecutor(max_workers=self.cpu_workers)
+        self.io = ThreadPoolExecutor(max_workers=self.io_workers)
+        budget_mb = config.get('PIXEL_BUDGET_MB', 1024)
+        self.pixels = MemoryBudget(budget_mb * 1024 * 1024) if budget_mb else None
+        print(f"Worker pool: {self.cpu_workers} {self.backend} worker(s) for images, {self.io_workers} for I/O")
+
+    def submit_page(self, footprint, fn, *args):
+        """
+        Submits a page stage to the cpu executor once footprint (bytes) fits into the pixel budget, blocking the
+        caller until then. The reservation is released when the stage has finished. A page larger than the whole
+        budget still runs, alone.
+        """
+        if self.pixels is None:
+            return self.cpu.submit(fn, *args)
+        self.pixels.acquire(footprint)
+        try:
+            future = self.cpu.submit(fn, *args)
+        except BaseException:
+            self.pixels.release(footprint)
+            raise
+        future.add_done_callback(lambda _: self.pixels.release(footprint))
+        return future
+
+    def shutdown(self, wait=True):
+        self.cpu.shutdown(wait=wait)
+        self.io.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
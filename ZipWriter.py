@@ -0,0 +1,182 @@
+import os
+import struct
+import time
+import zlib
+from collections import deque
+
+# Members that are already compressed gain next to nothing from deflate
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip', '.rar', '.7z')
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+_UTF8_FLAG = 0x800
+_MAX_32 = 0xFFFFFFFF
+_MAX_16 = 0xFFFF
+# Sizes and offsets from this value on are written into ZIP64 records (0xFFFFFFFF itself marks them)
+_ZIP64_LIMIT = _MAX_32
+
+
+def _deflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _limit(value):
+    """A size or offset as written into a 32-bit field: 0xFFFFFFFF when it is in a ZIP64 record instead."""
+    return _MAX_32 if value >= _ZIP64_LIMIT else value
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    year = max(1980, year)
+    return ((year - 1980) << 9 | month << 5 | day), (hour << 11 | minute << 5 | second // 2)
+
+
+class ZipWriter:
+    """
+    Writes a ZIP file with the compression chosen per member and deflate running in parallel.
+
+    mode:
+    - 'auto': STORE members listed in STORED_EXTENSIONS (JPEG pages etc.), deflate the others
+    - 'store': STORE everything
+    - 'deflate': deflate everything
+
+    Deflated members are compressed on executor (if given) while earlier members are written; the members are
+    still written in the order they were added. The file is written as final_path + '.part' and renamed to
+    final_path by close(), so a partial ZIP never appears under the final name.
+    Members and archives of 4 GB or more, or with more than 65535 members, get ZIP64 records, like zipfile writes.
+    """
+
+    def __init__(self, final_path, mode='auto', executor=None, level=6):
+        if mode not in ('auto', 'store', 'deflate'):
+            raise ValueError(f"Unknown zip mode: {mode}")
+        self.final_path = final_path
+        self.temp_path = final_path + '.part'
+        self.mode = mode
+        self.executor = executor
+        self.level = level
+        self.file = open(self.temp_path, 'wb')
+        self.pending = deque()  # (arcname, date_time, method, crc, size, data or future), in order
+        self.central_directory = []
+        self.names = set()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def compress_type(self, arcname):
+        if self.mode == 'store' or (self.mode == 'auto' and arcname.lower().endswith(STORED_EXTENSIONS)):
+            return ZIP_STORED
+        return ZIP_DEFLATED
+
+    def add_bytes(self, arcname, data, date_time=None):
+        arcname = arcname.replace(os.sep, '/').lstrip('/')
+        if arcname in self.names:
+            raise ValueError(f"Duplicate name in zip: {arcname}")
+        self.names.add(arcname)
+
+        method = self.compress_type(arcname)
+        if method == ZIP_STORED:
+            payload = data
+        elif self.executor is not None:
+            payload = self.executor.submit(_deflate, data, self.level)
+        else:
+            payload = _deflate(data, self.level)
+        self.pending.append((arcname, date_time or time.localtime(), method, zlib.crc32(data), len(data), payload))
+        self.flush(block=False)
+
+    def add_raw(self, arcname, date_time, method, crc, size, compressed):
+        """Adds a member that is already compressed (e.g. copied from another ZIP), as it is."""
+        if method not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ValueError(f"Unsupported compression method: {method}")
+        arcname = arcname.replace(os.sep, '/').lstrip('/')
+        if arcname in self.names:
+            raise ValueError(f"Duplicate name in zip: {arcname}")
+        self.names.add(arcname)
+        self.pending.append((arcname, date_time, method, crc, size, compressed))
+        self.flush(block=False)
+
+    def add_file(self, file_path, arcname):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        self.add_bytes(arcname, data, time.localtime(os.path.getmtime(file_path)))
+
+    def flush(self, block=True):
+        """Writes the pending members whose compression has finished, keeping their order."""
+        while self.pending:
+            payload = self.pending[0][5]
+            if hasattr(payload, 'result'):
+                if not block and not payload.done():
+                    return
+                payload = payload.result()
+            arcname, date_time, method, crc, size, _ = self.pending.popleft()
+            self._write_member(arcname, date_time, method, crc, size, payload)
+
+    def _write_member(self, arcname, date_time, method, crc, size, compressed):
+        offset = self.file.tell()
+        name = arcname.encode('utf-8')
+        dos_date, dos_time = _dos_date_time(date_time)
+        # The sizes, and in the central directory the offset too, that do not fit go into a ZIP64 extra field
+        zip64 = max(size, len(compressed)) >= _ZIP64_LIMIT
+        large = [value for value in (size, len(compressed), offset) if value >= _ZIP64_LIMIT]
+        version = 45 if large else 20 if method == ZIP_DEFLATED else 10
+        local_extra = struct.pack('<2H2Q', 1, 16, size, len(compressed)) if zip64 else b''
+        central_extra = struct.pack(f'<2H{len(large)}Q', 1, 8 * len(large), *large) if large else b''
+
+        self.file.write(struct.pack('<4s5H3L2H', b'PK\x03\x04', version, _UTF8_FLAG, method, dos_time, dos_date,
+                                    crc, _MAX_32 if zip64 else len(compressed), _MAX_32 if zip64 else size,
+                                    len(name), len(local_extra)))
+        self.file.write(name)
+        self.file.write(local_extra)
+        self.file.write(compressed)
+        self.central_directory.append(struct.pack('<4s6H3L5H2L', b'PK\x01\x02', version, version, _UTF8_FLAG,
+                                                  method, dos_time, dos_date, crc, _limit(len(compressed)),
+                                                  _limit(size), len(name), len(central_extra), 0, 0, 0, 0,
+                                                  _limit(offset)) + name + central_extra)
+        self.bytes_in += size
+        self.bytes_out += len(compressed)
+
+    def close(self):
+        """Writes the remaining members and the central directory, then renames the file to its final name."""
+        try:
+            self.flush()
+            offset = self.file.tell()
+            for entry in self.central_directory:
+                self.file.write(entry)
+            size = self.file.tell() - offset
+            count = len(self.central_directory)
+            if count > _MAX_16 or max(size, offset) >= _ZIP64_LIMIT:
+                # ZIP64 end of central directory record and its locator, the plain record below only says so
+                zip64_offset = self.file.tell()
+                self.file.write(struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count, size,
+                                            offset))
+                self.file.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_offset, 1))
+            self.file.write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, min(count, _MAX_16), min(count, _MAX_16),
+                                        _limit(size), _limit(offset), 0))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self.temp_path, self.final_path)
+        except BaseException:
+            self.abort()
+            raise
+        self.seconds = time.perf_counter() - self.started
+
+    def abort(self):
+        """Discards the partial file."""
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def throughput(self):
+        """Returns the input MB/s of the finished ZIP."""
+        return self.bytes_in / 1024 / 1024 / self.seconds if self.seconds else 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
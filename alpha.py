@@ -0,0 +1,87 @@
+"""
+Alpha handling of the page stages: watermark opacity, the watermark layer, compositing it onto a page and
+flattening transparent pages onto white.
+
+Everything runs in Pillow's C loops. Opacity goes through a lookup table built once per opacity, and the watermark
+layer is prepared once per watermark instead of once per page. Opaque pages (L, P, RGB) get the watermark pasted
+straight into their RGB buffer, and transparent pages (LA, RGBA, P with transparency) are only converted in the
+region under the watermark. Transparent pages are flattened with their own alpha band as the mask (no copy of it).
+"""
+from PIL import Image
+
+WHITE = (255, 255, 255)
+
+# Modes that carry an alpha band
+ALPHA_MODES = ('RGBA', 'LA', 'PA', 'RGBa', 'La')
+
+_opacity_luts = {}
+
+
+def opacity_lut(opacity):
+    """Returns the 256-entry table scaling an alpha value by opacity (rounded like Image.point rounds)."""
+    lut = _opacity_luts.get(opacity)
+    if lut is None:
+        lut = _opacity_luts[opacity] = [round(value * opacity) for value in range(256)]
+    return lut
+
+
+def apply_opacity(image, opacity):
+    """Scales the alpha band of an RGBA image by opacity, in place, and returns the image."""
+    image.putalpha(image.getchannel('A').point(opacity_lut(opacity)))
+    return image
+
+
+def watermark_layer(watermark):
+    """
+    Returns the RGBA watermark as it is blended onto a page: pasted onto a transparent layer with its own alpha
+    as the mask (the way the original full-canvas compositing built it). Built once per prepared watermark.
+    """
+    layer = Image.new('RGBA', watermark.size)
+    layer.paste(watermark, (0, 0), watermark)
+    return layer
+
+
+def has_alpha(image):
+    return image.mode in ALPHA_MODES or 'transparency' in image.info
+
+
+def composite_layer(page, layer, box, output):
+    """
+    Blends layer (a watermark_layer cropped to box) over the box of page and writes the result into output,
+    the RGB image of the page (page itself when it is RGB).
+
+    An opaque page needs no conversion at all: pasting the layer with its alpha as the mask is the same blend.
+    A transparent page is blended with its own alpha, converting the box only.
+    """
+    if not has_alpha(page):
+        output.paste(layer, box[:2], layer)
+        return
+    region = page.crop(box).convert('RGBA')
+    region.alpha_composite(layer)
+    output.paste(region.convert('RGB'), box[:2])
+
+
+def expand_palette(image):
+    """Expands P and 1 images to RGB (RGBA with transparency) so they can be resized with LANCZOS."""
+    if image.mode in ('1', 'P'):
+        return image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    return image
+
+
+def flatten(image, background=WHITE, output=None, position=(0, 0)):
+    """
+    Flattens an RGBA or LA image onto background and returns it as RGB, using the image itself as the paste
+    mask. When output is given, image is flattened into it at position instead (output must already hold the
+    background there).
+    """
+    if output is None:
+        output = Image.new('RGB', image.size, background)
+    output.paste(image, position, image)
+    return output
+
+
+def to_rgb(image, background=WHITE):
+    """Returns image as RGB: transparent images are flattened onto background, RGB images are returned as they are."""
+    if image.mode in ('RGBA', 'LA'):
+        return flatten(image, background)
+    return image if image.mode == 'RGB' else image.convert('RGB')
@@ -0,0 +1,679 @@
+"""
+Opens .rar, .7z and .zip archives once and indexes their members (Archive), extracts them, reads them
+straight into memory without extracting them to disk (the streaming mode of Handler), and re-extracts
+single members when an interrupted job is resumed. Dropped folders of pages are read through the same
+interface (Folder).
+
+A multi-volume RAR set (name.part1.rar, name.part2.rar, ...) is one archive, known by its first volume: see
+first_volume(), volume_paths() and volumes_complete().
+
+The RAR and 7z backends (rarfile, py7zr) are imported on first use, so a setup that only receives .zip files
+never loads them.
+"""
+import fnmatch
+import io
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import zipfile
+from collections import namedtuple
+
+ARCHIVE_EXTENSIONS = ('.rar', '.7z', '.zip')
+# Members processed as pages, the others are copied as they are
+PAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# Volumes of a multi-volume RAR set, numbered from part1 (or part01, part001 with zero padding)
+VOLUME_PATTERN = re.compile(r'^(.*\.part)(\d+)(\.rar)$')
+
+_unrar_tool = None
+
+
+def set_unrar_tool(path):
+    """Sets the UnRAR executable used by rarfile, applied when rarfile is loaded."""
+    global _unrar_tool
+    _unrar_tool = path
+    rarfile = sys.modules.get('rarfile')
+    if rarfile and path:
+        rarfile.UNRAR_TOOL = path
+
+
+def load_rarfile():
+    import rarfile
+    if _unrar_tool:
+        rarfile.UNRAR_TOOL = _unrar_tool
+    return rarfile
+
+
+def load_py7zr():
+    import py7zr
+    return py7zr
+
+
+def open_archive(file_path):
+    """Opens the archive with the backend matching its extension, for use as a context manager."""
+    if file_path.endswith('.rar'):
+        return load_rarfile().RarFile(file_path)
+    elif file_path.endswith('.7z'):
+        return load_py7zr().SevenZipFile(file_path, mode='r')
+    elif file_path.endswith('.zip'):
+        return support_gbk(zipfile.ZipFile(file_path, 'r'))
+    raise ValueError(f"Unsupported file type: {file_path}")
+
+
+def first_volume(path):
+    """Returns the first volume of the RAR volume set path is a part of, or None if it is not a volume."""
+    match = VOLUME_PATTERN.match(path)
+    if not match:
+        return None
+    prefix, number, extension = match.groups()
+    return f"{prefix}{'1'.zfill(len(number))}{extension}"
+
+
+def volume_paths(path):
+    """
+    Returns the volumes of the set path is a part of that are there so far, from the first one up to the first
+    missing one. Anything else (a single archive, a folder) is its own only volume.
+    """
+    first = first_volume(path)
+    if first is None:
+        return [path]
+    prefix, number, extension = VOLUME_PATTERN.match(first).groups()
+    volumes = []
+    while True:
+        volume = f"{prefix}{str(len(volumes) + 1).zfill(len(number))}{extension}"
+        if not os.path.isfile(volume):
+            return volumes
+        volumes.append(volume)
+
+
+def volumes_complete(path):
+    """
+    Whether every volume of the set path is the first volume of is there: rarfile follows the volumes from the
+    first one and stops with an error at the first missing one. Always True for anything but a volume set.
+    """
+    if first_volume(path) is None:
+        return True
+    try:
+        with load_rarfile().RarFile(path) as rf:
+            return not rf.strerror()
+    except Exception:
+        return False  # e.g. the first volume itself is still being written
+
+
+def natural_key(name):
+    """Sort key ordering '2.png' before '10.png' (case-insensitive), the order pages are read in."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+# credit: https://blog.csdn.net/qq_21076851/article/details/122752196
+def support_gbk(zip_file: zipfile.ZipFile):
+    name_to_info = zip_file.NameToInfo
+
+    for name, info in name_to_info.copy().items():
+        real_name = name.encode('cp437').decode('gbk')
+        if real_name != name:
+            info.filename = real_name
+            del name_to_info[name]
+            name_to_info[real_name] = info
+    return zip_file
+
+
+ArchiveMember = namedtuple('ArchiveMember', 'name size compressed_size is_image')
+
+
+class MemberFilter:
+    """
+    Decides which archive members are kept, before anything is extracted or decoded.
+
+    - include: glob patterns a member must match (default: everything)
+    - exclude: glob patterns of members that are dropped (OS metadata, nested archives, ...)
+    - max_size: members larger than this many bytes are dropped (0 = no limit)
+
+    Patterns containing a '/' are matched against the whole member name, the others against the file name only,
+    so 'Thumbs.db' also drops 'Chapter 1/Thumbs.db'. Matching is case-insensitive.
+    """
+
+    def __init__(self, include=('*',), exclude=(), max_size=0):
+        self.include = [pattern.lower() for pattern in include]
+        self.exclude = [pattern.lower() for pattern in exclude]
+        self.max_size = max_size
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('MEMBER_INCLUDE', ('*',)), config.get('MEMBER_EXCLUDE', ()),
+                   int(config.get('MAX_MEMBER_MB', 0) * 1024 * 1024))
+
+    @staticmethod
+    def matches(name, patterns):
+        name = name.lower()
+        base = name.rsplit('/', 1)[-1]
+        return any(fnmatch.fnmatchcase(name if '/' in pattern else base, pattern) for pattern in patterns)
+
+    def __call__(self, member):
+        if self.max_size and member.size > self.max_size:
+            return False
+        return self.matches(member.name, self.include) and not self.matches(member.name, self.exclude)
+
+
+class MemberIndex:
+    """Members of an Archive or a Folder, split into kept pages, pass-through members and skipped members."""
+
+    is_folder = False
+
+    def index(self, members, member_filter=None):
+        keep = member_filter or (lambda member: True)
+        kept = [member for member in members if keep(member)]
+        duplicates = self.duplicate_pages(kept)
+        self.members = [member for member in kept if member.name not in duplicates]
+        self.skipped = [member for member in members if not keep(member) or member.name in duplicates]
+        self.pages = sorted((member.name for member in self.members if member.is_image), key=natural_key)
+        self.pass_through = [member.name for member in self.members if not member.is_image]
+
+    @staticmethod
+    def duplicate_pages(members):
+        """
+        Pages whose JPEG would have the name of an earlier page's, e.g. '001.png' next to '001.jpg': only the
+        first one in natural order is kept, the others are skipped.
+        """
+        stems, duplicates = set(), set()
+        for name in sorted((member.name for member in members if member.is_image), key=natural_key):
+            stem = os.path.splitext(name)[0]
+            if stem in stems:
+                duplicates.add(name)
+            stems.add(stem)
+        return duplicates
+
+    @property
+    def names(self):
+        return [member.name for member in self.members]
+
+    @property
+    def total_size(self):
+        """Uncompressed size of the kept members, in bytes."""
+        return sum(member.size for member in self.members)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Archive(MemberIndex):
+    """
+    An archive opened once, with the index of its members read from the headers (nothing is decompressed).
+
+    - members: ArchiveMember for every file kept by member_filter (directories excluded), in archive order
+    - skipped: the members member_filter dropped, and pages whose JPEG would have the name of another page's
+      (see duplicate_pages()); they are neither extracted nor written to the output
+    - pages: names of the image members, in natural order (the order PAGE_IGNORE_COUNT counts from)
+    - pass_through: the other members, copied into the output as they are
+    - common_root: deepest folder containing every member ('' for flat archives)
+    - output_name: name of the output folder and .zip, the common root or else the archive name. A flat .zip
+      therefore gets an output of its own name, which replaces it (see Handler.move_original_file())
+
+    Streaming and the planning of an archive use the same open handle and index; the ranges of a parallel
+    extraction open handles of their own (see extract_async()). Pass-through members of .zip archives are copied
+    into the output still compressed (copy_raw), the other formats have to decompress them.
+    A RAR volume set is opened from its first volume and read across all of them.
+    """
+
+    def __init__(self, file_path, member_filter=None):
+        self.file_path = file_path
+        self.handle = open_archive(file_path)
+        self.is_7z = file_path.endswith('.7z')
+        self.is_zip = file_path.endswith('.zip')
+        self.used = False  # py7zr has to be reset before decoding a second time
+        self.closed = False
+        self.infos = {}  # member name -> backend info (ZipInfo, RarInfo or py7zr FileInfo)
+        try:
+            members = self.read_index()
+        except Exception:
+            self.handle.close()
+            raise
+        self.index(members, member_filter)
+        self.common_root = self.find_common_root()
+        self.output_name = os.path.basename(self.common_root) or os.path.splitext(os.path.basename(file_path))[0]
+
+    def read_index(self):
+        if self.is_7z:
+            infos = [(info.filename, info.uncompressed, info.compressed, info)
+                     for info in self.handle.list() if not info.is_directory]
+        else:
+            infos = [(info.filename, info.file_size, info.compress_size, info)
+                     for info in self.handle.infolist() if not info.is_dir()]
+        self.infos = {name: info for name, size, compressed_size, info in infos}
+        # Solid 7z blocks have no per-member compressed size
+        return [ArchiveMember(name, size or 0, compressed_size, name.lower().endswith(PAGE_EXTENSIONS))
+                for name, size, compressed_size, info in infos]
+
+    def find_common_root(self):
+        # Compared folder by folder: a plain common prefix would cut '000.png' and '001.png' down to '00'
+        folders = [member.name.split('/')[:-1] for member in self.members]
+        if not folders:
+            return ''
+        root = folders[0]
+        for parts in folders[1:]:
+            length = 0
+            while length < min(len(root), len(parts)) and root[length] == parts[length]:
+                length += 1
+            root = root[:length]
+        return '/'.join(root)
+
+    @property
+    def raw_members(self):
+        """Pass-through members copied without decompressing them (only .zip allows it)."""
+        return self.pass_through if self.is_zip else []
+
+    @property
+    def extract_names(self):
+        """Members that have to be decompressed: the pages and the pass-through members that cannot be copied raw."""
+        return self.pages + [name for name in self.pass_through if not self.is_zip]
+
+    def extraction_root(self, target_directory):
+        """Folder the archive is extracted into: flat archives get a folder of their own."""
+        return target_directory if self.common_root else os.path.join(target_directory, self.output_name)
+
+    def page_directory(self, target_directory):
+        """Folder holding the extracted pages, the one compressed into the output .zip."""
+        if self.common_root:
+            return os.path.join(target_directory, *self.common_root.split('/'))
+        return os.path.join(target_directory, self.output_name)
+
+    def output_arcname(self, name):
+        """Name of a member in the output .zip: relative to the folder above the page directory."""
+        if not self.common_root:
+            return f"{self.output_name}/{name}"
+        parent = os.path.dirname(self.common_root)
+        return name[len(parent) + 1:] if parent else name
+
+    def extract_async(self, target_directory, workers=1, on_finished=None):
+        """
+        Starts extracting extract_names under extraction_root(target_directory) on background threads and returns
+        the Extraction, which tells when each member is on disk (see Extraction.wait()).
+
+        The members are split into up to workers ranges of consecutive members, each decoded by its own thread
+        with its own handle: single members of a .zip, whole blocks of a 7z (see extract_units()). The members
+        of a solid block, and every member of a RAR archive, come out one after the other on a single thread.
+        on_finished(error) runs once the last range has finished (error is None when everything was extracted).
+        """
+        extraction = Extraction(self.extraction_root(target_directory), on_finished)
+        if self.is_7z:
+            extract = self._extract_7z_range
+        elif self.is_zip:
+            extract = self._extract_zip_range
+        else:
+            extract = self._extract_rar_range
+        for names in self.extract_ranges(workers):
+            extraction.add(extract, names)
+        extraction.start()
+        return extraction
+
+    def extract_units(self, names):
+        """
+        Groups names into the units that can be decoded independently, in archive order: single members of a .zip,
+        the members of each 7z block (one block for a solid archive), all the members of a RAR archive.
+        """
+        wanted = set(names)
+        if self.is_zip:
+            return [[info.filename] for info in self.handle.infolist() if info.filename in wanted]
+        if not self.is_7z:
+            return [[name for name in self.infos if name in wanted]]
+        blocks = {}
+        for file in self.handle.files:
+            if file.filename in wanted:
+                # Members without a block are empty, they are written with any of them
+                blocks.setdefault(id(file.folder) if file.folder is not None else None, []).append(file.filename)
+        return list(blocks.values())
+
+    def extract_ranges(self, workers=1):
+        """Splits extract_names into up to workers ranges of whole units with about the same uncompressed size."""
+        units = self.extract_units(self.extract_names)
+        sizes = {member.name: member.size for member in self.members}
+        unit_sizes = [sum(sizes.get(name, 0) for name in unit) for unit in units]
+        total = sum(unit_sizes)
+        count = max(1, min(workers, len(units)))
+        ranges, done = [[]], 0
+        for unit, size in zip(units, unit_sizes):
+            if ranges[-1] and len(ranges) < count and done >= total * len(ranges) / count:
+                ranges.append([])
+            ranges[-1].extend(unit)
+            done += size
+        return [names for names in ranges if names]
+
+    def _extract_zip_range(self, names, extraction):
+        with open_archive(self.file_path) as zf:
+            for name in names:
+                if extraction.stopped.is_set():
+                    return
+                zf.extract(zf.getinfo(name), extraction.root)
+                extraction.done(name)
+
+    def _extract_rar_range(self, names, extraction):
+        for name in names:
+            if extraction.stopped.is_set():
+                return
+            self.handle.extract(self.infos[name], extraction.root)
+            extraction.done(name)
+
+    def _extract_7z_range(self, names, extraction):
+        for name in names:
+            # The members are written by our own code here, not by py7zr which checks this itself
+            if name.startswith('/') or '..' in name.split('/'):
+                raise ValueError(f"Unsafe member name: {name}")
+        wanted = set(names)
+        modified = {file.filename: file.lastwritetime.totimestamp() for file in self.handle.files
+                    if file.filename in wanted and file.lastwritetime is not None}
+
+        def write(name, data):
+            if extraction.stopped.is_set():
+                raise _Stopped()
+            path = extraction.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            if name in modified:
+                os.utime(path, (modified[name], modified[name]))  # like py7zr's own extraction
+            extraction.done(name)
+
+        # Opened from a file object, py7zr decodes the blocks of the range one after the other on this thread
+        with open(self.file_path, 'rb') as f, load_py7zr().SevenZipFile(f, mode='r') as z:
+            factory = _member_factory(write)
+            z.extract(targets=names, factory=factory)
+            for product in factory.products:
+                product.close()
+
+    def extract(self, target_directory, names):
+        """Extracts only the given members (again), overwriting them."""
+        if not names:
+            return
+        self.reset()
+        path = self.extraction_root(target_directory)
+        if self.is_7z:
+            self.handle.extract(path=path, targets=names)
+        else:
+            self.handle.extractall(path, [self.infos[name] for name in names])
+
+    def iter_members(self, buffer_size=4, names=None):
+        """
+        Yields (name, data) for the given members (default: extract_names) in archive order.
+
+        For 7z archives the decoder runs on a helper thread and hands members over through a queue of
+        buffer_size entries, so a solid block is decoded once while memory stays bounded.
+        """
+        wanted = set(self.extract_names if names is None else names)
+        self.reset()
+        if self.is_7z:
+            yield from _iter_7z_members(self.handle, buffer_size, wanted)
+            return
+        for info in self.handle.infolist():
+            if info.filename in wanted:
+                yield info.filename, self.handle.read(info)
+
+    def copy_raw(self, writer, names=None):
+        """
+        Copies the given .zip members (default: raw_members) into a ZipWriter without decompressing them,
+        under their output_arcname. Members that cannot be copied as they are (encrypted, other methods)
+        are decompressed and added again.
+        """
+        names = self.raw_members if names is None else names
+        if not names:
+            return
+        with open(self.file_path, 'rb') as f:
+            for name in names:
+                info = self.infos[name]
+                if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    with zipfile.ZipFile(self.file_path) as zf:
+                        writer.add_bytes(self.output_arcname(name), zf.read(info), info.date_time)
+                    continue
+                f.seek(info.header_offset)
+                header = f.read(30)
+                name_length, extra_length = struct.unpack('<2H', header[26:30])
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                writer.add_raw(self.output_arcname(name), info.date_time, info.compress_type, info.CRC,
+                               info.file_size, f.read(info.compress_size))
+
+    def reset(self):
+        if self.is_7z and self.used:
+            self.handle.reset()
+        self.used = True
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.handle.close()
+
+
+class _Stopped(Exception):
+    """Raised inside a decoder to abandon an Extraction that was closed before it finished."""
+
+
+class Extraction:
+    """
+    An extraction running on background threads, one per range of members (see Archive.extract_async()).
+
+    wait(path) returns as soon as that member is on disk, so a page can be processed while the rest of the archive
+    is still being decoded; wait() returns once everything is extracted. Both raise the error of a failed range.
+    Leaving the context (or close()) stops the ranges that are still running and waits for their threads.
+    """
+
+    def __init__(self, root, on_finished=None):
+        self.root = root
+        self.on_finished = on_finished
+        self.names = set()  # members being extracted
+        self.extracted = set()  # paths of the members on disk
+        self.error = None
+        self.threads = []
+        self.running = 0
+        self.stopped = threading.Event()
+        self.condition = threading.Condition()
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def add(self, extract, names):
+        """Adds a range of members, extracted by extract(names, extraction) on a thread of its own."""
+        self.names.update(names)
+        self.threads.append(threading.Thread(target=self.run, args=(extract, names), daemon=True))
+
+    def start(self):
+        """Starts the ranges; on_finished runs right away when there is nothing to extract."""
+        self.running = len(self.threads)
+        for thread in self.threads:
+            thread.start()
+        if not self.threads and self.on_finished:
+            self.on_finished(None)
+
+    def run(self, extract, names):
+        error = None
+        try:
+            extract(names, self)
+        except _Stopped:
+            pass
+        except Exception as e:
+            error = e
+        with self.condition:
+            self.error = self.error or error
+            self.running -= 1
+            finished = not self.running
+            self.condition.notify_all()
+        if finished and self.on_finished and not self.stopped.is_set():
+            self.on_finished(self.error)
+
+    def done(self, name):
+        with self.condition:
+            self.extracted.add(self.path(name))
+            self.condition.notify_all()
+
+    def wait(self, path=None):
+        """Waits until the member extracted to path (default: every member) is on disk."""
+        with self.condition:
+            while self.running and not self.error and (path is None or path not in self.extracted):
+                self.condition.wait()
+            if self.error:
+                raise self.error
+
+    def close(self):
+        self.stopped.set()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Folder(MemberIndex):
+    """
+    A dropped folder of pages, read through the same interface as Archive. Its members are the files below it,
+    named relative to it; the folder itself is the page directory and gives the output .zip its name.
+    Nothing has to be extracted, and pass-through members are read like the pages.
+    """
+
+    is_folder = True
+    common_root = ''
+    raw_members = []
+
+    def __init__(self, folder, member_filter=None):
+        self.file_path = folder
+        self.output_name = os.path.basename(folder)
+        members = []
+        for root, dirs, files in os.walk(folder):
+            dirs.sort(key=natural_key)
+            for file in sorted(files, key=natural_key):
+                path = os.path.join(root, file)
+                name = os.path.relpath(path, folder).replace(os.sep, '/')
+                size = os.path.getsize(path)
+                members.append(ArchiveMember(name, size, size, name.lower().endswith(PAGE_EXTENSIONS)))
+        self.index(members, member_filter)
+
+    @property
+    def extract_names(self):
+        return self.pages + self.pass_through
+
+    def extraction_root(self, target_directory):
+        return self.file_path
+
+    def page_directory(self, target_directory):
+        return self.file_path
+
+    def output_arcname(self, name):
+        return f"{self.output_name}/{name}"
+
+    def path(self, name):
+        return os.path.join(self.file_path, *name.split('/'))
+
+    def iter_members(self, buffer_size=4, names=None):
+        """Yields (name, data) for the given members (default: extract_names) in folder order."""
+        wanted = set(self.extract_names if names is None else names)
+        for member in self.members:
+            if member.name in wanted:
+                with open(self.path(member.name), 'rb') as f:
+                    yield member.name, f.read()
+
+    def copy_raw(self, writer, names=None):
+        pass  # nothing is compressed in a folder
+
+    def close(self):
+        pass
+
+
+def open_source(path, member_filter=None):
+    """Returns the Folder or Archive at path."""
+    return Folder(path, member_filter) if os.path.isdir(path) else Archive(path, member_filter)
+
+
+_member_factory_class = None
+
+
+def _member_factory(on_close):
+    """Returns a py7zr writer factory handing every member over through on_close, once py7zr has finished it."""
+    global _member_factory_class
+    if _member_factory_class is None:
+        from py7zr.io import Py7zIO, WriterFactory
+
+        class MemberIO(Py7zIO):
+            def __init__(self, filename, on_close):
+                self.filename = filename
+                self.on_close = on_close
+                self.buffer = io.BytesIO()
+                self.handed_over = False
+
+            def write(self, s):
+                return self.buffer.write(s)
+
+            def read(self, size=None):
+                return self.buffer.read(size)
+
+            def seek(self, offset, whence=0):
+                return self.buffer.seek(offset, whence)
+
+            def flush(self):
+                pass
+
+            def size(self):
+                return self.buffer.getbuffer().nbytes
+
+            def close(self):
+                if not self.handed_over:
+                    self.handed_over = True
+                    self.on_close(self.filename, self.buffer.getvalue())
+
+        class MemberFactory(WriterFactory):
+            def __init__(self, on_close):
+                self.on_close = on_close
+                self.products = []
+
+            def create(self, filename):
+                product = MemberIO(filename, self.on_close)
+                self.products.append(product)
+                return product
+
+        _member_factory_class = MemberFactory
+    return _member_factory_class(on_close)
+
+
+_END = object()
+
+
+def _iter_7z_members(z, buffer_size, names):
+    members = queue.Queue(maxsize=max(1, buffer_size))
+    stopped = threading.Event()
+
+    def put(item):
+        # Give up when the consumer went away, instead of blocking the decoder thread forever
+        while not stopped.is_set():
+            try:
+                members.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def decode():
+        try:
+            factory = _member_factory(lambda name, data: put((name, data)))
+            z.extract(targets=names, factory=factory)
+            # py7zr versions without the close() hook: hand over what is left
+            for product in factory.products:
+                product.close()
+            put(_END)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=decode, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = members.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,160 @@
+"""
+Headless batch mode: processes the archives already sitting in one or more folders, without the GUI or watchdog.
+With FOLDER_DROP, the sub folders holding pages are processed as well, like folders dropped into the watcher.
+
+Usage:
+    python batch.py _target_
+    python batch.py _target_ other_folder --config config.json --set OUTPUT_QUALITY=85 --dry-run
+
+The output .zip files and the original archives end up in the parent folder of each scanned folder,
+exactly like with the watcher.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+from Handler import Handler
+from Scheduler import Scheduler, job_size
+from WorkerPool import WorkerPool
+from archives import ARCHIVE_EXTENSIONS, PAGE_EXTENSIONS, MemberFilter, first_volume, open_source, set_unrar_tool, \
+    volumes_complete
+from config import load_config
+from metrics import metrics
+
+# Rough single-worker speed for a 1600x2400 page, used by --dry-run (see benchmarks/bench_workers.py)
+PAGES_PER_SECOND_PER_WORKER = 3.0
+
+
+def find_archives(directories, recursive=False):
+    archives = []
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            # A volume set is processed from its first volume
+            archives += [os.path.abspath(os.path.join(root, file)) for file in sorted(files)
+                         if file.lower().endswith(ARCHIVE_EXTENSIONS) and first_volume(file) in (None, file)]
+            if not recursive:
+                break
+    return archives
+
+
+def find_folders(directories):
+    """Returns the sub folders (one level down) of the given folders that hold pages."""
+    folders = []
+    for directory in directories:
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if entry.is_dir() and any(file.lower().endswith(PAGE_EXTENSIONS)
+                                      for root, dirs, files in os.walk(entry.path) for file in files):
+                folders.append(os.path.abspath(entry.path))
+    return folders
+
+
+def plan(archives, config):
+    """
+    Lists the pages of every archive (from the archive headers only) or folder and estimates the processing time.
+    """
+    total_pages = 0
+    member_filter = MemberFilter.from_config(config)
+    for path in archives:
+        try:
+            with open_source(path, member_filter) as archive:
+                pages, size = len(archive.pages), archive.total_size
+                output_name = archive.output_name
+        except Exception as e:
+            print(f"  {path}: cannot be read ({e})")
+            continue
+        total_pages += pages
+        print(f"  {path}: {pages} pages, {job_size(path) / 1024 / 1024:.1f} MB "
+              f"({size / 1024 / 1024:.1f} MB extracted) -> {output_name}.zip")
+
+    workers = config['CPU_WORKERS']
+    seconds = total_pages / (PAGES_PER_SECOND_PER_WORKER * workers)
+    print(f"{len(archives)} jobs, {total_pages} pages, about {seconds:.0f}s with {workers} image workers")
+
+
+def show_progress(total, done_event):
+    start = time.time()
+    while not done_event.wait(1):
+        counters = metrics.snapshot()['counters']
+        elapsed = time.time() - start
+        print(f"\r[{counters.get('archives', 0)}/{total} archives] {counters.get('pages', 0)} pages, "
+              f"{counters.get('pages', 0) / elapsed:.1f} pages/s, {counters.get('errors', 0)} errors",
+              end='', flush=True)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directories', nargs='+',
+                        help="Folders containing .zip, .rar or .7z files (or folders of pages)")
+    parser.add_argument('--config', help="JSON file overriding DEFAULT_CONFIG")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="Override a single setting, e.g. --set OUTPUT_HEIGHT=1600")
+    parser.add_argument('--workers', type=int, help="Image workers (CPU_WORKERS)")
+    parser.add_argument('--recursive', action='store_true', help="Also scan sub folders")
+    parser.add_argument('--dry-run', action='store_true', help="Only print the planned work and its estimated cost")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.set)
+    if args.workers:
+        config['CPU_WORKERS'] = args.workers
+    set_unrar_tool(config['unrar_tool'])
+    archives = find_archives(args.directories, args.recursive)
+    for path in [path for path in archives if not volumes_complete(path)]:
+        print(f"Skipped {path}: volumes are missing")
+        archives.remove(path)
+    folders = find_folders(args.directories) if config.get('FOLDER_DROP', True) else []
+    print(f"Found {len(archives)} archives" + (f" and {len(folders)} folders of pages" if folders else ""))
+    archives += folders
+    if args.dry_run:
+        plan(archives, config)
+        return 0
+    if not archives:
+        return 0
+
+    if config.get('SPOOL_DIR'):
+        # Claims are keyed by the path relative to the scanned folders, the same on every host
+        config['WORKING_DIR'] = os.path.commonpath([os.path.abspath(directory) for directory in args.directories])
+    pool = WorkerPool(config)
+    scheduler = Scheduler(config.get('MAX_CONCURRENT_ARCHIVES', 2), len(archives),
+                          config.get('MEMORY_BUDGET_MB', 2048))
+    handler = Handler(config, pool, scheduler)
+    if handler.journal and folders:
+        # A folder extracted by an interrupted run is resumed with its archive, not processed as a dropped folder
+        extracted = {handler.journal.get(path).get('extracted_subdir') for path in handler.journal.unfinished()}
+        archives = [path for path in archives if path not in extracted]
+    scheduler.start(handler.process_job, handler.output_path)
+    if handler.spool:
+        handler.spool.start()
+
+    done = threading.Event()
+    progress = threading.Thread(target=show_progress, args=(len(archives), done), daemon=True)
+    progress.start()
+    try:
+        for path in archives:
+            scheduler.submit(path)
+        if handler.spool:
+            # The archives claimed by other workers are done by them, or queued here again if they die
+            while not scheduler.idle() or handler.spool.held_elsewhere(archives):
+                time.sleep(0.5)
+        scheduler.stop(drain=True)
+    finally:
+        done.set()
+        progress.join()
+        if handler.spool:
+            handler.spool.stop()
+        pool.shutdown()
+        if handler.journal:
+            handler.journal.close()
+    print(f"Scheduler: {scheduler.stats()}")
+    if handler.spool:
+        print(f"Spool: {handler.spool.stats()}")
+
+    return 1 if metrics.snapshot()['counters'].get('errors') else 0
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Compares region-only watermark compositing with the original full-canvas alpha_composite:
+time per page, extra peak RSS per page and the largest pixel difference between both outputs.
+
+Usage: python benchmarks/bench_composite.py [--width W] [--height H] [--repeat N]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageChops
+
+from fixtures import make_page, make_watermark
+from utils import composite_watermark, get_watermark
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+
+def _measure(page_path, watermark_file, region_only, repeat, queue):
+    # Runs in a fresh process so that the RSS high-water mark only reflects this variant
+    watermark = get_watermark(watermark_file, 200, 0.75)
+    with Image.open(page_path) as page:
+        page.load()
+        baseline = _peak_rss_kb()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            composite_watermark(page, watermark, region_only=region_only)
+        elapsed = (time.perf_counter() - start) / repeat
+    queue.put({'ms_per_page': round(elapsed * 1000, 2), 'extra_peak_rss_mb': round((_peak_rss_kb() - baseline) / 1024, 1)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=12000, help="Tall, webtoon-style page by default")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        page_path = make_page(os.path.join(tmp, 'page.png'), args.width, args.height)
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+
+        for name, region_only in (('full_canvas', False), ('region_only', True)):
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_measure,
+                                              args=(page_path, watermark_file, region_only, args.repeat, queue))
+            process.start()
+            results[name] = queue.get()
+            process.join()
+
+        watermark = get_watermark(watermark_file, 200, 0.75)
+        with Image.open(page_path) as page:
+            diff = ImageChops.difference(composite_watermark(page, watermark, region_only=False),
+                                         composite_watermark(page, watermark, region_only=True))
+        results['max_pixel_difference'] = max(high for low, high in diff.getextrema())
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Compares the JPEG encoder settings (encoder.py) on output pages, i.e. pages already watermarked and resized to
+OUTPUT_HEIGHT the way the fused page stage hands them to the encoder:
+- gray: a grayscale page with the (colored) watermark
+- gray_credit: a grayscale page without watermark, like the last PAGE_IGNORE_COUNT pages
+- color: a tinted page with the watermark
+
+For every setting: the output size, the bytes saved and the extra encode time per page against plain
+OUTPUT_QUALITY encoding, the number of encodes (quality searches) and the PSNR of the output against the page.
+
+Usage: python benchmarks/bench_encoder.py [--width W] [--height H] [--quality Q] [--target-kb KB] [--target-psnr DB]
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageOps
+
+from fixtures import make_page, make_watermark
+import encoder
+import utils
+
+
+def variants(args):
+    return {
+        'baseline': {},
+        'optimize': {'JPEG_OPTIMIZE': True},
+        'progressive': {'JPEG_PROGRESSIVE': True},
+        'optimize_progressive': {'JPEG_OPTIMIZE': True, 'JPEG_PROGRESSIVE': True},
+        'subsampling_444': {'JPEG_SUBSAMPLING': '4:4:4'},
+        'grayscale': {'JPEG_GRAYSCALE': True, 'JPEG_OPTIMIZE': True},
+        'target_psnr': {'JPEG_TARGET_PSNR': args.target_psnr, 'JPEG_OPTIMIZE': True},
+        'target_kb': {'JPEG_TARGET_KB': args.target_kb, 'JPEG_OPTIMIZE': True},
+    }
+
+
+def output_pages(tmp, args, watermark_file):
+    with Image.open(make_page(os.path.join(tmp, 'page.png'), args.width, args.height, mode='L')) as page:
+        page.load()
+    tinted = ImageOps.colorize(page, (20, 10, 40), (255, 235, 210))
+    pages = {}
+    for name, image, watermark in (('gray', page, True), ('gray_credit', page, False), ('color', tinted, True)):
+        pages[name] = utils.watermark_and_resize(image.copy(), 200, watermark_file, 0.75, args.output_height,
+                                                 watermark)
+    return pages
+
+
+def measure(image, quality, settings, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data, attempts = encoder.encode_jpeg(image, quality, settings)
+    elapsed = (time.perf_counter() - start) / repeat
+    with Image.open(io.BytesIO(data)) as decoded:
+        reference = image if decoded.mode == image.mode else image.convert(decoded.mode)
+    return {'kb': round(len(data) / 1024, 1), 'encode_ms': round(elapsed * 1000, 1), 'encodes': attempts,
+            'psnr_db': round(encoder.psnr(reference, data), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=2400)
+    parser.add_argument('--output-height', type=int, default=1200)
+    parser.add_argument('--quality', type=int, default=80)
+    parser.add_argument('--target-kb', type=int, default=100)
+    parser.add_argument('--target-psnr', type=float, default=38.0)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+        for page_name, image in output_pages(tmp, args, watermark_file).items():
+            entry = {}
+            for name, overrides in variants(args).items():
+                settings = encoder.settings_from_config(overrides)
+                entry[name] = measure(image, args.quality, settings, args.repeat)
+                baseline = entry['baseline']
+                entry[name]['saved_pct'] = round((1 - entry[name]['kb'] / baseline['kb']) * 100, 1)
+                entry[name]['extra_ms'] = round(entry[name]['encode_ms'] - baseline['encode_ms'], 1)
+            results[page_name] = entry
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
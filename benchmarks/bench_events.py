@@ -0,0 +1,71 @@
+"""
+Counts the watchdog events the Watcher receives while it processes a drop of archives, with the archives extracted
+next to them inside the watched folder (WORK_DIR='') and in the WORK_DIR staging area outside of it. Reports the
+events received and the ones dropped as the handler's own (extracted pages, outputs), and the wall time of the drop.
+
+Usage: python benchmarks/bench_events.py [--archives N] [--pages N]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from fixtures import make_archive, make_chapter, make_watermark
+from DirectoryWatcher import Watcher
+from config import DEFAULT_CONFIG
+from metrics import metrics
+
+
+def run(archives, work_dir, watermark_file, variant_dir, work_dir_setting):
+    target = os.path.join(variant_dir, '_target_')
+    os.makedirs(target)
+    config = dict(DEFAULT_CONFIG, WORKING_DIR=target, WATERMARK_FILE=watermark_file, JOURNAL_FILE='',
+                  WORK_DIR=work_dir_setting and os.path.join(variant_dir, work_dir_setting))
+    before = metrics.snapshot()['counters']
+    watcher = Watcher(target, config)
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    time.sleep(0.5)
+
+    start = time.perf_counter()
+    for archive in archives:
+        shutil.copy(archive, target)
+    outputs = [os.path.join(variant_dir, f"Chapter {i}.zip") for i in range(len(archives))]
+    while not all(os.path.exists(output) for output in outputs):
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    time.sleep(1)  # late events
+    watcher.stop()
+    thread.join()
+
+    after = metrics.snapshot()['counters']
+    counted = {name: after.get(name, 0) - before.get(name, 0) for name in ('events', 'events_ignored')}
+    return {**counted, 'seconds': round(elapsed, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archives', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=1200)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+        archives = []
+        for i in range(args.archives):
+            chapter = make_chapter(os.path.join(tmp, 'source', f"Chapter {i}"), args.pages, args.width, args.height)
+            archives.append(make_archive(os.path.dirname(chapter[0]), os.path.join(tmp, 'source', f"ch{i}.zip")))
+        for name, work_dir in (('in_watched_folder', ''), ('work_dir', '_work_')):
+            results[name] = run(archives, work_dir, watermark_file, os.path.join(tmp, name), work_dir)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures the extraction stage (Archive.extract_async()) for every archive format that can be created here:
+- zip: deflated .zip, its members are extracted in parallel ranges
+- 7z_solid: a 7z with a single solid block, decoded member after member on one thread
+- 7z_blocks: a non-solid 7z (one block per page), its blocks are extracted in parallel ranges
+- rar: only when the rar command line tool is installed, decoded member after member
+
+For 1 to --workers EXTRACT_WORKERS: the extraction time per GB of extracted data, the throughput in MB/s and the
+time until the first page is on disk (when the page stage can start on it), best of --repeat runs. 'one_call' is
+the extraction in a single backend call (Archive.extract(), as before), where no page is ready before the last one.
+
+Usage: python benchmarks/bench_extract.py [--pages N] [--width W] [--height H] [--workers N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from fixtures import available_formats, make_archive, make_chapter
+from archives import Archive
+
+
+def measure(archive_path, target_directory, workers):
+    shutil.rmtree(target_directory, ignore_errors=True)
+    with Archive(archive_path) as archive:
+        start = time.perf_counter()
+        if not workers:
+            archive.extract(target_directory, archive.extract_names)
+            seconds = time.perf_counter() - start
+            return seconds, seconds, archive.total_size, 1
+        with archive.extract_async(target_directory, workers) as extraction:
+            extraction.wait(extraction.path(archive.pages[0]))
+            first_page = time.perf_counter() - start
+            extraction.wait()
+        return time.perf_counter() - start, first_page, archive.total_size, len(archive.extract_ranges(workers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=40)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=2400)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = {'cpu_count': os.cpu_count()}
+    with tempfile.TemporaryDirectory() as tmp:
+        chapter = os.path.dirname(make_chapter(os.path.join(tmp, 'Chapter'), args.pages, args.width, args.height)[0])
+        archives = {'zip': make_archive(chapter, os.path.join(tmp, 'chapter.zip')),
+                    '7z_solid': make_archive(chapter, os.path.join(tmp, 'chapter.7z')),
+                    '7z_blocks': make_archive(chapter, os.path.join(tmp, 'chapter_blocks.7z'), solid=False)}
+        if 'rar' in available_formats():
+            archives['rar'] = make_archive(chapter, os.path.join(tmp, 'chapter.rar'))
+
+        for name, archive_path in archives.items():
+            entry = {'archive_mb': round(os.path.getsize(archive_path) / 1024 / 1024, 1)}
+            for workers in range(args.workers + 1):
+                runs = [measure(archive_path, os.path.join(tmp, 'out'), workers) for _ in range(args.repeat)]
+                seconds, first_page, size, ranges = min(runs)
+                entry[f"workers_{workers}" if workers else 'one_call'] = {
+                    'ranges': ranges,
+                    's_per_gb': round(seconds / (size / 1024 ** 3), 2),
+                    'mb_per_s': round(size / 1024 / 1024 / seconds, 1),
+                    'first_page_ms': round(first_page * 1000, 1),
+                }
+            entry['extracted_mb'] = round(size / 1024 / 1024, 1)
+            results[name] = entry
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Times the fused page stage (watermark_and_compress_bytes) for every supported page type, with one entry per type:
+PNG in RGB, RGBA, L and P mode, JPEG (with draft-mode decoding, and without it for comparison), WebP, and a PNG
+that is already smaller than OUTPUT_HEIGHT (no resize). Reports pages/s and the mean milliseconds per step.
+
+Usage: python benchmarks/bench_page_types.py [--pages N] [--width W] [--height H] [--output-height H]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from fixtures import make_page, make_watermark
+import utils
+
+# name -> (file extension, image mode, page size relative to --width/--height)
+PAGE_TYPES = {
+    'png_rgb': ('.png', 'RGB', 1.0),
+    'png_rgba': ('.png', 'RGBA', 1.0),
+    'png_l': ('.png', 'L', 1.0),
+    'png_p': ('.png', 'P', 1.0),
+    'jpeg': ('.jpg', 'RGB', 1.0),
+    'jpeg_no_draft': ('.jpg', 'RGB', 1.0),
+    'webp': ('.webp', 'RGB', 1.0),
+    'png_small': ('.png', 'RGB', 0.4),
+}
+
+
+def run(pages, args, watermark_file):
+    steps = {}
+    start = time.perf_counter()
+    for data in pages:
+        output, stats = utils.watermark_and_compress_bytes(data, args.watermark_size, watermark_file, args.opacity,
+                                                           args.output_height, args.quality)
+        for step in ('decode', 'watermark', 'resize', 'encode'):
+            steps[step] = steps.get(step, 0.0) + stats.get(step, 0.0)
+    elapsed = time.perf_counter() - start
+    result = {'pages_per_s': round(len(pages) / elapsed, 2),
+              'input_kb': round(sum(len(data) for data in pages) / len(pages) / 1024, 1)}
+    result.update({f'{step}_ms': round(seconds / len(pages) * 1000, 2) for step, seconds in steps.items()})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=2400)
+    parser.add_argument('--watermark-size', type=int, default=200)
+    parser.add_argument('--opacity', type=float, default=0.75)
+    parser.add_argument('--output-height', type=int, default=1200)
+    parser.add_argument('--quality', type=int, default=80)
+    args = parser.parse_args()
+
+    results = {}
+    draft_for_height = utils.draft_for_height
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+        utils.get_watermark(watermark_file, args.watermark_size, args.opacity)  # not part of the first entry
+        for name, (ext, mode, size) in PAGE_TYPES.items():
+            pages = []
+            for i in range(args.pages):
+                path = make_page(os.path.join(tmp, f'{name}_{i}{ext}'), int(args.width * size),
+                                 int(args.height * size), seed=i, mode=mode)
+                with open(path, 'rb') as f:
+                    pages.append(f.read())
+            if name == 'jpeg_no_draft':
+                utils.draft_for_height = lambda img, output_height: 1.0
+            try:
+                results[name] = run(pages, args, watermark_file)
+            finally:
+                utils.draft_for_height = draft_for_height
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares the 'legacy' two-pass pipeline (apply_watermark to PNG, then compress_image)
+with the 'fused' single-pass pipeline (watermark_and_compress).
+
+Usage: python benchmarks/bench_pipeline_modes.py [--pages N] [--width W] [--height H]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from fixtures import make_chapter, make_watermark
+from utils import apply_watermark, compress_image, watermark_and_compress
+
+
+def run_legacy(pages, args, watermark_file):
+    for page in pages:
+        apply_watermark(page, os.path.dirname(page), args.watermark_size, watermark_file, args.opacity)
+    for page in pages:
+        compress_image(page, args.output_height, args.quality)
+
+
+def run_fused(pages, args, watermark_file):
+    for page in pages:
+        watermark_and_compress(page, args.watermark_size, watermark_file, args.opacity,
+                               args.output_height, args.quality)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=2400)
+    parser.add_argument('--watermark-size', type=int, default=200)
+    parser.add_argument('--opacity', type=float, default=0.75)
+    parser.add_argument('--output-height', type=int, default=1200)
+    parser.add_argument('--quality', type=int, default=80)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+        for name, runner in (('legacy', run_legacy), ('fused', run_fused)):
+            pages = make_chapter(os.path.join(tmp, name), args.pages, args.width, args.height)
+            start = time.perf_counter()
+            runner(pages, args, watermark_file)
+            elapsed = time.perf_counter() - start
+            results[name] = {'seconds': round(elapsed, 3), 'pages_per_s': round(args.pages / elapsed, 2)}
+
+    results['speedup'] = round(results['legacy']['seconds'] / results['fused']['seconds'], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
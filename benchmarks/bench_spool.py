@@ -0,0 +1,130 @@
+"""
+Runs several batch.py workers as separate processes against one watched folder and one SPOOL_DIR, on this host:
+- single: one worker without a spool, the reference output
+- workers_N: N workers started together; reports the wall time, the archives and shards each worker processed,
+  whether every archive was processed exactly once and whether the outputs are byte-identical to the reference
+- dead_worker: a worker is killed (SIGKILL) as soon as it has claimed an archive, a second worker is started
+  right after; reports how long it took to reclaim and finish the dead worker's archive
+
+The large archive (--big-pages) is split into shards of --shard-pages pages that any worker can process.
+On a single core the workers only share the same CPU: the point is the coordination, not the speed-up.
+
+Usage: python benchmarks/bench_spool.py [--archives N] [--pages N] [--big-pages N] [--shard-pages N] [--workers N]
+"""
+import argparse
+import ast
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from fixtures import REPO_ROOT, make_archive, make_chapter, make_watermark
+
+
+def worker(directory, worker_id, settings, log):
+    args = [sys.executable, os.path.join(REPO_ROOT, 'batch.py'), '_target_', '--set', 'JOURNAL_FILE=',
+            '--set', 'CPU_WORKERS=1', '--set', 'MAX_CONCURRENT_ARCHIVES=1']
+    if worker_id:
+        args += ['--set', f"SPOOL_DIR={os.path.join(directory, 'spool')}", '--set', f"WORKER_ID={worker_id}"]
+    for key, value in settings.items():
+        args += ['--set', f"{key}={value}"]
+    return subprocess.Popen(args, cwd=directory, stdout=log, stderr=subprocess.STDOUT)
+
+
+def report(directory, log_names):
+    """Spool stats and moved originals of every worker, from its output."""
+    workers = {}
+    for name in log_names:
+        with open(os.path.join(directory, f"{name}.log"), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        stats = [ast.literal_eval(line[len('Spool: '):]) for line in lines if line.startswith('Spool: {')]
+        workers[name] = dict(stats[-1] if stats else {},
+                             archives_moved=sum(line.startswith('Original file moved to') for line in lines))
+    return workers
+
+
+def outputs(directory):
+    result = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.zip') and name[0].isupper():
+            with zipfile.ZipFile(os.path.join(directory, name)) as zf:
+                result[name] = {member: zf.read(member) for member in zf.namelist()}
+    return result
+
+
+def run(tmp, name, archives, settings, workers, kill_first=False):
+    directory = os.path.join(tmp, name)
+    os.makedirs(os.path.join(directory, '_target_'))
+    for archive in archives:
+        shutil.copy(archive, os.path.join(directory, '_target_'))
+    start = time.perf_counter()
+    logs = [open(os.path.join(directory, f"{worker_id}.log"), 'w') for worker_id in workers]
+    try:
+        if kill_first:
+            first = worker(directory, workers[0], settings, logs[0])
+            claims = os.path.join(directory, 'spool', 'claims')
+            while not (os.path.isdir(claims) and os.listdir(claims)):
+                time.sleep(0.05)
+            first.kill()
+            first.wait()
+            killed = time.perf_counter()
+            processes = [worker(directory, worker_id, settings, log) for worker_id, log in zip(workers[1:], logs[1:])]
+        else:
+            processes = [worker(directory, worker_id, settings, log) for worker_id, log in zip(workers, logs)]
+        for process in processes:
+            process.wait()
+    finally:
+        for log in logs:
+            log.close()
+    result = {'seconds': round(time.perf_counter() - start, 2)}
+    if kill_first:
+        result['seconds_after_kill'] = round(time.perf_counter() - killed, 2)
+    if workers[0]:
+        result['workers'] = report(directory, workers[1:] if kill_first else workers)
+    return result, outputs(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--archives', type=int, default=6)
+    parser.add_argument('--pages', type=int, default=8)
+    parser.add_argument('--big-pages', type=int, default=40)
+    parser.add_argument('--shard-pages', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=3.0, help="WORKER_TIMEOUT_SECONDS")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {'WATERMARK_FILE': make_watermark(os.path.join(tmp, 'watermark.png')),
+                    'SHARD_PAGES': args.shard_pages, 'HEARTBEAT_SECONDS': args.timeout / 6,
+                    'WORKER_TIMEOUT_SECONDS': args.timeout}
+        archives = []
+        for i in range(args.archives):
+            chapter = make_chapter(os.path.join(tmp, 'source', f"Chapter {i}"), args.pages, 800, 1200)
+            archives.append(make_archive(os.path.dirname(chapter[0]), os.path.join(tmp, 'source', f"ch{i}.zip")))
+        make_chapter(os.path.join(tmp, 'source', 'Big'), args.big_pages, 800, 1200)
+        archives.append(make_archive(os.path.join(tmp, 'source', 'Big'), os.path.join(tmp, 'source', 'big.zip')))
+
+        results['single'], reference = run(tmp, 'single', archives, settings, [''])
+        variants = [(f"workers_{count}", [f"w{i}" for i in range(count)], False)
+                    for count in range(1, args.workers + 1)]
+        variants.append(('dead_worker', ['killed', 'survivor'], True))
+        for name, workers, kill_first in variants:
+            result, produced = run(tmp, name, archives, settings, workers, kill_first)
+            result['outputs_complete'] = sorted(produced) == sorted(reference)
+            result['outputs_identical'] = produced == reference
+            if not kill_first:
+                result['processed_once'] = sum(worker['archives_moved'] for worker in result['workers'].values()) \
+                    == len(archives)
+            results[name] = result
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Startup budget: imports the entry modules in fresh interpreters with `python -X importtime` and checks that
+they stay under their time budget and never load the modules they should not need (tkinter, the archive
+backends, watchdog, http.server). Exits with 1 when a budget is exceeded, so it can run in CI.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--scale 2.0]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from fixtures import REPO_ROOT
+
+# module -> (budget in ms, modules that must not be imported along with it)
+BUDGETS = {
+    'config': (15, ('tkinter', 'PIL', 'watchdog', 'py7zr', 'rarfile')),
+    'archives': (100, ('tkinter', 'py7zr', 'rarfile')),
+    'Handler': (150, ('tkinter', 'watchdog', 'py7zr', 'rarfile', 'http.server', 'multiprocessing')),
+    'batch': (160, ('tkinter', 'watchdog', 'py7zr', 'rarfile', 'http.server', 'multiprocessing')),
+    'main': (60, ('tkinter', 'watchdog', 'py7zr', 'rarfile', 'PIL')),
+}
+
+
+def import_time(module):
+    """Returns (cumulative import time in ms, names of every imported module) for one fresh interpreter."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True)
+    total_us, imported = 0, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        if name.strip() == module:
+            total_us = int(cumulative_us)
+    return total_us / 1000, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters per module, the median is kept")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplies every budget (slow machines)")
+    args = parser.parse_args()
+
+    results, failed = {}, False
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        runs = [import_time(module) for _ in range(args.runs)]
+        ms = statistics.median(run[0] for run in runs)
+        loaded = sorted(name for name in forbidden
+                        if any(imported == name or imported.startswith(name + '.') for imported in runs[0][1]))
+        ok = ms <= budget_ms * args.scale and not loaded
+        failed |= not ok
+        results[module] = {'ms': round(ms, 1), 'budget_ms': budget_ms * args.scale, 'unexpected_imports': loaded,
+                           'ok': ok}
+
+    print(json.dumps(results, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
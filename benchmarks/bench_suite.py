@@ -0,0 +1,185 @@
+"""
+Benchmark suite for the whole archive pipeline, on synthetic chapters generated locally.
+
+For every archive format that can be created here (zip, 7z and rar when the rar tool is installed) it times
+each stage on its own (extraction, determine_extracted_subdirectory, apply_watermark, compress_image,
+compress_and_move_folder) and the end-to-end pipeline driven through Handler, in extract and streaming mode.
+Results are printed as JSON (and written to --output) with pages/s, MB/s and the peak RSS so far.
+
+Usage:
+    python benchmarks/bench_suite.py --pages 20 --output before.json
+    python benchmarks/bench_suite.py --pages 20 --compare before.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+import py7zr
+import rarfile
+
+from fixtures import available_formats, make_archive, make_chapter, make_watermark
+from Handler import Handler
+from archives import support_gbk
+from utils import apply_watermark, compress_and_move_folder, compress_image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1)
+
+
+def extract(file_path, target_directory):
+    # Same calls as Handler.extract_rar/extract_7z/extract_zip, without the processing that follows
+    if file_path.endswith('.rar'):
+        with rarfile.RarFile(file_path) as rf:
+            rf.extractall(target_directory)
+    elif file_path.endswith('.7z'):
+        with py7zr.SevenZipFile(file_path, mode='r') as z:
+            z.extractall(path=target_directory)
+    else:
+        with support_gbk(zipfile.ZipFile(file_path, 'r')) as zf:
+            zf.extractall(target_directory)
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(folder) for f in files)
+
+
+class Timer:
+    def __init__(self, results, name, pages=0, size=0):
+        self.results = results
+        self.name = name
+        self.pages = pages
+        self.size = size
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self.start
+        result = {'seconds': round(seconds, 4), 'peak_rss_mb': peak_rss_mb()}
+        if self.pages:
+            result['pages_per_s'] = round(self.pages / seconds, 2)
+        if self.size:
+            result['mb_per_s'] = round(self.size / 1024 / 1024 / seconds, 2)
+        self.results[self.name] = result
+
+
+def run_stages(archive, config, work_dir, pages):
+    """Times each stage of the extract mode separately."""
+    results = {}
+    target_directory = os.path.join(work_dir, 'stages', '_target_')
+    os.makedirs(target_directory)
+    file_path = shutil.copy(archive, target_directory)
+    handler = Handler(config)
+
+    with Timer(results, 'extract', pages, os.path.getsize(archive)):
+        extract(file_path, target_directory)
+    with Timer(results, 'determine_extracted_subdirectory'):
+        extracted_subdir = handler.determine_extracted_subdirectory(file_path, target_directory)
+
+    png_files = sorted(os.path.join(extracted_subdir, f) for f in os.listdir(extracted_subdir) if f.endswith('.png'))
+    with Timer(results, 'apply_watermark', pages, folder_size(extracted_subdir)):
+        for page in png_files:
+            apply_watermark(page, target_directory, config['WATERMARK_SIZE'], config['WATERMARK_FILE'],
+                            config['WATERMARK_OPACITY'])
+    with Timer(results, 'compress_image', pages, folder_size(extracted_subdir)):
+        for page in png_files:
+            compress_image(page, config['OUTPUT_HEIGHT'], config['OUTPUT_QUALITY'])
+    with Timer(results, 'compress_and_move_folder', pages, folder_size(extracted_subdir)):
+        compress_and_move_folder(extracted_subdir, '', os.path.basename(extracted_subdir),
+                                 config.get('ZIP_MODE', 'auto'))
+    handler.pool.shutdown()
+    return results
+
+
+def run_end_to_end(archive, config, work_dir, pages, name):
+    """Times Handler.process_archive on a fresh copy of the archive."""
+    results = {}
+    target_directory = os.path.join(work_dir, name, '_target_')
+    os.makedirs(target_directory)
+    file_path = shutil.copy(archive, target_directory)
+    handler = Handler(config)
+    with Timer(results, name, pages, os.path.getsize(archive)):
+        handler.process_archive(file_path)
+    handler.pool.shutdown()
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """Prints the stages that got slower than the baseline by more than threshold (e.g. 0.1 = 10%)."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for fmt, stages in results['formats'].items():
+        for stage, result in stages.items():
+            before = baseline.get('formats', {}).get(fmt, {}).get(stage)
+            if before and result['seconds'] > before['seconds'] * (1 + threshold):
+                regressions.append(f"{fmt}/{stage}: {before['seconds']}s -> {result['seconds']}s")
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=2400)
+    parser.add_argument('--formats', nargs='*', default=available_formats())
+    parser.add_argument('--backend', default='thread', choices=('thread', 'process', 'auto'))
+    parser.add_argument('--output', help="Write the JSON results to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = {'pages': args.pages, 'size': [args.width, args.height], 'formats': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {
+            'unrar_tool': rarfile.UNRAR_TOOL,
+            'WATERMARK_FILE': make_watermark(os.path.join(tmp, 'watermark.png')),
+            'WATERMARK_SIZE': 200,
+            'WATERMARK_OPACITY': 0.75,
+            'OUTPUT_HEIGHT': 1200,
+            'OUTPUT_QUALITY': 80,
+            'PAGE_IGNORE_COUNT': 2,
+            'EXECUTOR_BACKEND': args.backend,
+            'CPU_WORKERS': os.cpu_count() or 1,
+            'MAX_WORKERS': (os.cpu_count() or 1) * 2
+        }
+        chapter = os.path.join(tmp, 'source', 'Chapter 1')
+        make_chapter(chapter, args.pages, args.width, args.height)
+
+        for fmt in args.formats:
+            archive = make_archive(chapter, os.path.join(tmp, f"chapter.{fmt}"))
+            work_dir = os.path.join(tmp, fmt)
+            stages = run_stages(archive, config, work_dir, args.pages)
+            stages.update(run_end_to_end(archive, config, work_dir, args.pages, 'end_to_end'))
+            stages.update(run_end_to_end(archive, dict(config, STREAMING=True), work_dir, args.pages,
+                                         'end_to_end_streaming'))
+            results['formats'][fmt] = stages
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
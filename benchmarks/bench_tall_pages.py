@@ -0,0 +1,104 @@
+"""
+Peak memory of very tall (webtoon-style) pages:
+- per page: the strip path of the fused page stage (resize_in_strips) against the full-page path, with time per
+  page, extra peak RSS and the largest pixel difference between both outputs
+- per batch: --pages such pages on --workers thread workers at once, with and without the pixel budget
+  (PIXEL_BUDGET_MB), i.e. how many decoded pages are held at the same time
+
+Every variant runs in a fresh process, so the RSS high-water mark only reflects that variant.
+
+Pages are grayscale by default (--mode L), RGB pages never take the strip path (they are not copied anyway).
+
+Usage: python benchmarks/bench_tall_pages.py [--width W] [--height H] [--mode L] [--pages N] [--workers N]
+                                             [--budget-mb MB]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from fixtures import make_page, make_watermark
+import utils
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+
+def _page(data, watermark_file, strips, queue):
+    if not strips:
+        utils.STRIP_MIN_BYTES = float('inf')
+    utils.get_watermark(watermark_file, 200, 0.75)
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+    output, stats = utils.watermark_and_compress_bytes(data, 200, watermark_file, 0.75, 1200, 80)
+    queue.put({'ms_per_page': round((time.perf_counter() - start) * 1000, 1),
+               'extra_peak_rss_mb': round((_peak_rss_kb() - baseline) / 1024, 1), 'output': output})
+
+
+def _batch(data, watermark_file, pages, workers, budget_mb, queue):
+    from WorkerPool import WorkerPool
+    config = {'WATERMARK_FILE': watermark_file, 'WATERMARK_SIZE': 200, 'WATERMARK_OPACITY': 0.75,
+              'CPU_WORKERS': workers, 'MAX_WORKERS': 1, 'EXECUTOR_BACKEND': 'thread', 'PIXEL_BUDGET_MB': budget_mb}
+    with WorkerPool(config) as pool:
+        baseline = _peak_rss_kb()
+        start = time.perf_counter()
+        futures = [pool.submit_page(utils.page_footprint(data, 1200), utils.watermark_and_compress_bytes, data,
+                                    200, watermark_file, 0.75, 1200, 80) for _ in range(pages)]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+    queue.put({'pages_per_s': round(pages / elapsed, 2),
+               'extra_peak_rss_mb': round((_peak_rss_kb() - baseline) / 1024, 1)})
+
+
+def _run(target, *args):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (queue,))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=30000)
+    parser.add_argument('--mode', default='L', help="Page mode: L, P, RGB, RGBA, ...")
+    parser.add_argument('--pages', type=int, default=6)
+    parser.add_argument('--workers', type=int, default=6)
+    parser.add_argument('--budget-mb', type=int, default=128)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+        with open(make_page(os.path.join(tmp, 'page.png'), args.width, args.height, mode=args.mode), 'rb') as f:
+            data = f.read()
+        results['footprint_mb'] = round(utils.page_footprint(data, 1200) / 1024 / 1024, 1)
+
+        outputs = {}
+        for name, strips in (('full_page', False), ('strips', True)):
+            results[name] = _run(_page, data, watermark_file, strips)
+            outputs[name] = results[name].pop('output')
+        from PIL import Image, ImageChops
+        import io
+        diff = ImageChops.difference(*(Image.open(io.BytesIO(output)) for output in outputs.values()))
+        results['max_pixel_difference'] = max(high for low, high in diff.getextrema())
+
+        for name, budget_mb in (('batch_no_budget', 0), ('batch_budget', args.budget_mb)):
+            results[name] = _run(_batch, data, watermark_file, args.pages, args.workers, budget_mb)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares both WATERMARK_ORDER settings of the fused page stage (watermark_and_compress_bytes) per page type:
+- pixels processed per page: the image the watermark is composited onto and the pixels blended under the watermark
+- time per page
+- watermark_box: bounding box of the pixels the watermark changes on the output page (placement), for both orders
+- max_pixel_difference between the outputs of both orders (the resize_first watermark is sharper, not blurred)
+
+Usage: python benchmarks/bench_watermark_order.py [--width W] [--height H] [--repeat N]
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageChops
+
+from fixtures import make_page, make_watermark
+import utils
+
+
+class CompositeCounter:
+    """Wraps utils.composite_watermark to count the pixels it is given."""
+
+    def __init__(self):
+        self.composite = utils.composite_watermark
+        self.image_pixels = self.blended_pixels = 0
+
+    def __call__(self, base_image, watermark, *args, **kwargs):
+        self.image_pixels += base_image.width * base_image.height
+        self.blended_pixels += watermark.width * watermark.height
+        return self.composite(base_image, watermark, *args, **kwargs)
+
+
+def encode(data, watermark_file, resize_first, watermark=True):
+    output, stats = utils.watermark_and_compress_bytes(data, 200, watermark_file, 0.75, 1200, 95, watermark, '',
+                                                       resize_first)
+    return Image.open(io.BytesIO(output))
+
+
+def watermark_box(data, watermark_file, resize_first):
+    # Small JPEG noise is ignored
+    difference = ImageChops.difference(encode(data, watermark_file, resize_first),
+                                       encode(data, watermark_file, resize_first, watermark=False))
+    return difference.point(lambda value: 255 if value > 16 else 0).getbbox()
+
+
+def measure(data, watermark_file, resize_first, repeat):
+    counter = utils.composite_watermark = CompositeCounter()
+    try:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            utils.watermark_and_compress_bytes(data, 200, watermark_file, 0.75, 1200, 80, True, '', resize_first)
+        elapsed = (time.perf_counter() - start) / repeat
+    finally:
+        utils.composite_watermark = counter.composite
+    return {'ms_per_page': round(elapsed * 1000, 1),
+            'composited_image_pixels': counter.image_pixels // repeat,
+            'blended_pixels': counter.blended_pixels // repeat,
+            'watermark_box': list(watermark_box(data, watermark_file, resize_first))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=2400)
+    parser.add_argument('--height', type=int, default=3600)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+        utils.get_watermark(watermark_file, 200, 0.75)
+        for name, extension, mode in (('png_rgb', '.png', 'RGB'), ('png_rgba', '.png', 'RGBA'), ('png_l', '.png', 'L'),
+                                      ('jpeg', '.jpg', 'RGB')):
+            with open(make_page(os.path.join(tmp, name + extension), args.width, args.height, mode=mode), 'rb') as f:
+                data = f.read()
+            entry = {order: measure(data, watermark_file, order == 'resize_first', args.repeat)
+                     for order in ('watermark_first', 'resize_first')}
+            difference = ImageChops.difference(encode(data, watermark_file, False), encode(data, watermark_file, True))
+            entry['max_pixel_difference'] = max(high for low, high in difference.getextrema())
+            results[name] = entry
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures how the fused page stage scales from 1 to N image workers with the thread and process backends.
+
+Usage: python benchmarks/bench_workers.py [--pages N] [--max-workers N]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from fixtures import make_chapter, make_watermark
+from utils import watermark_and_compress
+from WorkerPool import WorkerPool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=24)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=2400)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        watermark_file = make_watermark(os.path.join(tmp, 'watermark.png'))
+        source_pages = make_chapter(os.path.join(tmp, 'source'), args.pages, args.width, args.height)
+
+        for backend in ('thread', 'process'):
+            for workers in range(1, args.max_workers + 1):
+                config = {'EXECUTOR_BACKEND': backend, 'CPU_WORKERS': workers, 'MAX_WORKERS': 1,
+                          'WATERMARK_FILE': watermark_file, 'WATERMARK_SIZE': 200, 'WATERMARK_OPACITY': 0.75}
+                work_dir = os.path.join(tmp, f"{backend}-{workers}")
+                shutil.copytree(os.path.join(tmp, 'source'), work_dir)
+                pages = [os.path.join(work_dir, os.path.basename(page)) for page in source_pages]
+
+                with WorkerPool(config) as pool:
+                    # Start every worker before timing, like a long-running Watcher would have
+                    list(pool.cpu.map(abs, range(workers)))
+                    start = time.perf_counter()
+                    futures = [pool.cpu.submit(watermark_and_compress, page, 200, watermark_file, 0.75, 1200, 80)
+                               for page in pages]
+                    for future in futures:
+                        future.result()
+                    elapsed = time.perf_counter() - start
+
+                results.append({'backend': backend, 'workers': workers, 'seconds': round(elapsed, 3),
+                                'pages_per_s': round(args.pages / elapsed, 2)})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Reports the output ZIP throughput (MB/s) of zipfile's single-threaded ZIP_DEFLATED (the previous writer)
+and of ZipWriter in 'auto', 'store' and 'deflate' mode, over a chapter of JPEG pages.
+
+Usage: python benchmarks/bench_zip_writer.py [--pages N] [--workers N]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from fixtures import make_chapter
+from ZipWriter import ZipWriter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        chapter = os.path.join(tmp, 'chapter')
+        for page in make_chapter(chapter, args.pages, 800, 1200):
+            with Image.open(page) as img:
+                img.save(os.path.splitext(page)[0] + '.jpg', 'JPEG', quality=80)
+            os.remove(page)
+        files = sorted(os.listdir(chapter))
+        total_mb = sum(os.path.getsize(os.path.join(chapter, f)) for f in files) / 1024 / 1024
+
+        start = time.perf_counter()
+        with zipfile.ZipFile(os.path.join(tmp, 'zipfile.zip'), 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for f in files:
+                zipf.write(os.path.join(chapter, f), f)
+        elapsed = time.perf_counter() - start
+        results['zipfile_deflated'] = {'mb_per_s': round(total_mb / elapsed, 1),
+                                       'output_mb': round(os.path.getsize(os.path.join(tmp, 'zipfile.zip')) / 2 ** 20, 2)}
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for mode in ('auto', 'store', 'deflate'):
+                output = os.path.join(tmp, f"{mode}.zip")
+                with ZipWriter(output, mode, executor) as writer:
+                    for f in files:
+                        writer.add_file(os.path.join(chapter, f), f)
+                results[mode] = {'mb_per_s': round(writer.throughput(), 1),
+                                 'output_mb': round(os.path.getsize(output) / 2 ** 20, 2)}
+
+    results['input_mb'] = round(total_mb, 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
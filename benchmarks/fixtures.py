@@ -0,0 +1,89 @@
+"""Synthetic pages and watermarks for the benchmarks (nothing here is shipped with the script)."""
+import os
+import random
+import shutil
+import subprocess
+import sys
+import zipfile
+
+from PIL import Image, ImageDraw
+
+# Make the script modules at the repository root importable from the benchmarks
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def make_page(path, width=1600, height=2400, seed=0, mode='RGB'):
+    """Draws a manga-like page (flat background, panels, some noise) and saves it to path."""
+    rng = random.Random(seed)
+    img = Image.new('RGB', (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(10, max(11, width // 2)), y0 + rng.randrange(10, max(11, height // 4))
+        shade = rng.randrange(0, 255)
+        draw.rectangle((x0, y0, x1, y1), fill=(shade, shade, shade), outline=(0, 0, 0), width=4)
+    noise = Image.effect_noise((width // 4, height // 4), 40).resize((width, height)).convert('RGB')
+    img = Image.blend(img, noise, 0.15)
+    if mode != 'RGB':
+        img = img.convert(mode)
+    img.save(path)
+    return path
+
+
+def make_watermark(path, width=400, height=120):
+    """Draws a semi-transparent RGBA watermark and saves it to path as PNG."""
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.rounded_rectangle((0, 0, width - 1, height - 1), radius=20, fill=(30, 60, 200, 160))
+    draw.text((20, height // 3), "watermark", fill=(255, 255, 255, 255))
+    img.save(path, 'PNG')
+    return path
+
+
+def make_chapter(directory, pages=10, width=1600, height=2400, mode='RGB', ext='.png'):
+    """Creates a folder of numbered synthetic pages and returns their paths in page order."""
+    os.makedirs(directory, exist_ok=True)
+    return [make_page(os.path.join(directory, f"{i:03d}{ext}"), width, height, seed=i, mode=mode)
+            for i in range(pages)]
+
+
+def available_formats():
+    """Archive formats that can be created here; RAR needs the rar command line tool."""
+    formats = ['zip', '7z']
+    if shutil.which('rar'):
+        formats.append('rar')
+    return formats
+
+
+def make_archive(chapter_dir, archive_path, solid=True):
+    """
+    Packs chapter_dir (as a top-level folder, like a typical upload) into a zip, 7z or rar archive.
+    solid=False writes a 7z with one block per file.
+    """
+    folder = os.path.basename(chapter_dir.rstrip('/\\'))
+    files = sorted(os.listdir(chapter_dir))
+    if archive_path.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(folder + '/', '')
+            for file in files:
+                zf.write(os.path.join(chapter_dir, file), f"{folder}/{file}")
+    elif archive_path.endswith('.7z'):
+        import py7zr
+        if solid:
+            with py7zr.SevenZipFile(archive_path, 'w') as z:
+                z.writeall(chapter_dir, folder)
+        else:
+            # Every session writes a block of its own (py7zr cannot read back a first block without any data)
+            with py7zr.SevenZipFile(archive_path, 'w') as z:
+                z.write(chapter_dir, folder)
+                z.write(os.path.join(chapter_dir, files[0]), f"{folder}/{files[0]}")
+            for file in files[1:]:
+                with py7zr.SevenZipFile(archive_path, 'a') as z:
+                    z.write(os.path.join(chapter_dir, file), f"{folder}/{file}")
+    elif archive_path.endswith('.rar'):
+        subprocess.run(['rar', 'a', '-ep1', '-idq', os.path.abspath(archive_path), chapter_dir], check=True)
+    else:
+        raise ValueError(f"Unsupported archive: {archive_path}")
+    return archive_path
@@ -0,0 +1,87 @@
+"""
+Default settings, shared by the GUI (main.py), the watcher and the headless batch mode. Importing this module
+loads nothing but the standard library.
+"""
+import os
+
+default_working_dir = '_target_'
+default_watermark_path = os.path.join(os.path.dirname(os.path.abspath(default_working_dir)), default_working_dir,
+                                      'watermark.png')
+
+DEFAULT_CONFIG = {
+    'unrar_tool': 'C:\\Program Files\\WinRAR\\UnRAR.exe',  # TODO: improve default UbRAR path
+    'WORKING_DIR': default_working_dir,
+    'WORK_DIR': '_work_',  # archives are extracted here, outside the watched folder ('' = next to the archive)
+    'EXTRACT_WORKERS': min(4, os.cpu_count() or 1),  # threads extracting a .zip or non-solid 7z (1 = one thread)
+    'WATERMARK_FILE': default_watermark_path,
+    'WATERMARK_SIZE': 200,
+    'WATERMARK_OPACITY': 0.75,
+    'OUTPUT_HEIGHT': 1200,
+    'OUTPUT_QUALITY': 80,
+    'JPEG_SUBSAMPLING': '4:2:0',  # chroma subsampling of the output pages: '4:2:0', '4:2:2' or '4:4:4'
+    'JPEG_OPTIMIZE': False,  # optimized Huffman tables: a few % smaller, slower to encode
+    'JPEG_PROGRESSIVE': False,  # progressive JPEGs (usually a bit smaller, shown progressively by browsers)
+    'JPEG_GRAYSCALE': False,  # pages without any color (watermark included) are saved as grayscale JPEGs
+    'JPEG_TARGET_KB': 0,  # per page, the highest quality up to OUTPUT_QUALITY that fits into this size (0 = off)
+    'JPEG_TARGET_PSNR': 0,  # per page, the lowest quality reaching this PSNR (dB) against the page (0 = off)
+    'JPEG_MIN_QUALITY': 50,  # lowest quality the two searches above may pick
+    'PAGE_IGNORE_COUNT': 2,
+    'PIPELINE_MODE': 'fused',  # 'fused' (single pass per page) or 'legacy' (watermark to PNG, then compress)
+    # 'watermark_first' (watermark the full page, then resize) or 'resize_first' (resize, then watermark at output size)
+    'WATERMARK_ORDER': 'watermark_first',
+    'READY_STABLE_SECONDS': 1.0,  # an archive is processed once its size and mtime stop changing for this long
+    'FOLDER_DROP': True,  # plain folders of pages dropped into _target_ are processed like archives
+    'FOLDER_STABLE_SECONDS': 3.0,  # a dropped folder is processed once no file in it changed for this long
+    'MAX_CONCURRENT_ARCHIVES': 2,  # archives processed at the same time, their pages share the worker pool
+    'JOB_QUEUE_SIZE': 64,  # ready archives waiting to be processed
+    'MEMORY_BUDGET_MB': 2048,  # archives are started only while their total size fits into this budget
+    'DRAIN_ON_STOP': True,  # process the queued archives before stopping (otherwise they are journaled for next start)
+    'STREAMING': False,  # read pages straight from the archive into the output zip, without extracting
+    'MAX_IN_FLIGHT_PAGES': 16,  # pages held in memory at a time in streaming mode
+    'MEMBER_INCLUDE': ['*'],  # glob patterns of the archive members to keep
+    # members dropped before extraction: OS metadata and nested archives (add e.g. '*.txt' for release notes)
+    'MEMBER_EXCLUDE': ['__MACOSX/*', '*/__MACOSX/*', '.DS_Store', '._*', 'Thumbs.db', 'desktop.ini',
+                       '*.zip', '*.rar', '*.7z'],
+    'MAX_MEMBER_MB': 0,  # members larger than this are dropped (0 = no limit)
+    'ZIP_MODE': 'auto',  # 'auto' (store JPEG pages, deflate the rest), 'store' or 'deflate'
+    'RESULT_CACHE_DIR': '',  # cache finished pages and archives here to skip re-uploads ('' = off)
+    'RESULT_CACHE_MB': 1024,  # least recently used entries are evicted beyond this size
+    'JOURNAL_FILE': 'journal.jsonl',  # progress of every archive, unfinished jobs are resumed on start ('' = off)
+    'SPOOL_DIR': '',  # shared folder coordinating several workers watching the same _target_ ('' = single worker)
+    'WORKER_ID': '',  # name of this worker in the spool ('' = host name and process id)
+    'HEARTBEAT_SECONDS': 5.0,  # how often a worker tells the spool it is alive
+    'WORKER_TIMEOUT_SECONDS': 30.0,  # a worker silent for this long is dead, its archives and shards are reclaimed
+    'SHARD_PAGES': 0,  # pages past the first SHARD_PAGES of an archive go to the other workers in shards (0 = off)
+    'SHARD_TIMEOUT_SECONDS': 600.0,  # a shard not done by then is processed by its owner, or its pages fail
+    'POLLING_OBSERVER': False,  # poll _target_ instead of waiting for events (network shares do not send any)
+    'METRICS_LOG': '',  # path of a JSON-lines file receiving every timing span and counter ('' = off)
+    'METRICS_PORT': 0,  # serve Prometheus text on http://127.0.0.1:<port>/metrics (0 = off)
+    'EXECUTOR_BACKEND': 'auto',  # 'thread', 'process' or 'auto' (processes when more than one core)
+    'PIXEL_BUDGET_MB': 1024,  # decoded pages held by all image workers at a time, estimated from headers (0 = off)
+    'CPU_WORKERS': os.cpu_count() or 4,  # image stages (decode, watermark, resize, encode)
+    'MAX_WORKERS': (os.cpu_count() or 4) * 2 - 1  # Example formula for I/O-bound tasks
+}
+
+
+def load_config(config_file=None, settings=()):
+    """
+    Returns DEFAULT_CONFIG updated with a JSON file and KEY=VALUE settings.
+
+    Parameters:
+    - config_file: path of a JSON object with the settings to override, or None
+    - settings: 'KEY=VALUE' strings, VALUE being a Python literal (plain strings may be written without quotes)
+    """
+    import ast
+    import json
+    config = dict(DEFAULT_CONFIG)
+    if config_file:
+        with open(config_file, encoding='utf-8') as f:
+            config.update(json.load(f))
+    for setting in settings:
+        key, _, value = setting.partition('=')
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass  # plain strings such as paths
+        config[key] = value
+    return config
@@ -0,0 +1,118 @@
+"""
+JPEG encoder stage of the page pipelines: the Pillow save options (subsampling, optimized Huffman tables,
+progressive), grayscale output for pages without any color, and per-page quality searches:
+- target bytes: the highest quality (up to OUTPUT_QUALITY) whose JPEG fits into JPEG_TARGET_KB
+- target PSNR: the lowest quality (from JPEG_MIN_QUALITY) whose JPEG is at least JPEG_TARGET_PSNR dB from the page
+
+The searches encode the page already in memory into memory buffers, at most MAX_SEARCH_STEPS times each (a binary
+search over the quality range), and the chosen buffer is written as it is, never encoded again.
+"""
+import io
+import math
+from collections import namedtuple
+
+from PIL import Image, ImageChops
+
+# Quality values tried per search; 6 steps cover a range of 64 values
+MAX_SEARCH_STEPS = 6
+
+JpegSettings = namedtuple('JpegSettings', 'subsampling optimize progressive grayscale target_bytes target_psnr '
+                                          'min_quality')
+
+
+def settings_from_config(config):
+    """Returns the JpegSettings of config, or None when they are all defaults (plain quality-only encoding)."""
+    settings = JpegSettings(config.get('JPEG_SUBSAMPLING', '4:2:0'), bool(config.get('JPEG_OPTIMIZE')),
+                            bool(config.get('JPEG_PROGRESSIVE')), bool(config.get('JPEG_GRAYSCALE')),
+                            int(config.get('JPEG_TARGET_KB', 0) * 1024), float(config.get('JPEG_TARGET_PSNR', 0)),
+                            config.get('JPEG_MIN_QUALITY', 50))
+    if settings[:6] == ('4:2:0', False, False, False, 0, 0.0):
+        return None
+    return settings
+
+
+def is_gray(image):
+    """Whether every pixel of an RGB image has R == G == B."""
+    if image.mode != 'RGB':
+        return image.mode in ('L', '1')
+    red, green, blue = image.split()
+    return ImageChops.difference(red, green).getbbox() is None and \
+        ImageChops.difference(green, blue).getbbox() is None
+
+
+def psnr(image, data):
+    """PSNR in dB of the JPEG data against image (inf when identical)."""
+    with Image.open(io.BytesIO(data)) as decoded:
+        histogram = ImageChops.difference(image, decoded.convert(image.mode)).histogram()
+    squared = sum(count * (index % 256) ** 2 for index, count in enumerate(histogram))
+    mse = squared / (image.width * image.height * len(image.getbands()))
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def lowest(low, high, ok):
+    """Lowest value of [low, high] for which ok holds (ok is monotonic), high when the steps run out or none does."""
+    for _ in range(MAX_SEARCH_STEPS):
+        if low >= high:
+            break
+        middle = (low + high) // 2
+        if ok(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return high
+
+
+def highest(low, high, ok):
+    """Highest value of [low, high] for which ok holds (ok is monotonic), low when the steps run out or none does."""
+    for _ in range(MAX_SEARCH_STEPS):
+        if low >= high:
+            break
+        middle = (low + high + 1) // 2
+        if ok(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def encode_jpeg(image, quality, settings=None):
+    """
+    Encodes image as JPEG with quality, or with the options and quality search of settings.
+
+    Returns:
+    - tuple: the JPEG bytes and the number of encodes it took
+    """
+    if settings is None:
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=quality)
+        return output.getvalue(), 1
+
+    if settings.grayscale and image.mode != 'L' and is_gray(image):
+        image = image.getchannel(0)
+    encoded = {}
+
+    def encode(value):
+        if value not in encoded:
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=value, subsampling=settings.subsampling, optimize=settings.optimize,
+                       progressive=settings.progressive)
+            encoded[value] = output.getvalue()
+        return encoded[value]
+
+    low = min(settings.min_quality, quality)
+    if settings.target_psnr:
+        quality = lowest(low, quality, lambda value: psnr(image, encode(value)) >= settings.target_psnr)
+    if settings.target_bytes and len(encode(quality)) > settings.target_bytes:
+        quality = highest(low, quality, lambda value: len(encode(value)) <= settings.target_bytes)
+    return encode(quality), len(encoded)
+
+
+def save_jpeg(image, path, quality, settings=None):
+    """encode_jpeg() into path. Returns the number of encodes it took."""
+    if settings is None:
+        image.save(path, 'JPEG', quality=quality)
+        return 1
+    data, attempts = encode_jpeg(image, quality, settings)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return attempts
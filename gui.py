@@ -3,7 +3,8 @@ import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from DirectoryWatcher import Watcher
-from main import DEFAULT_CONFIG
+from config import DEFAULT_CONFIG
+from metrics import metrics
 
 # Global variable for the watcher thread
 watcher_thread = None
@@ -15,6 +16,7 @@ def start_watcher():
     global watcher_thread, watcher
     try:
         config = {
+            **DEFAULT_CONFIG,
             'unrar_tool': unrar_tool_entry.get(),
             'WATERMARK_FILE': watermark_path_entry.get(),
             'WATERMARK_SIZE': int(watermark_scale_entry.get()),
@@ -227,10 +229,29 @@ start_button.grid(row=0, column=0, padx=5, pady=5, sticky='e')
 stop_button = tk.Button(button_frame, text="Stop", command=stop_watcher, state='disabled')
 stop_button.grid(row=0, column=1, padx=5, pady=5, sticky='w')
 
-# Optionally, add a status bar or additional widgets that can expand
-# status_var = tk.StringVar(value="Ready")
-# status_bar = tk.Label(root, textvariable=status_var, bd=1, relief='sunken', anchor='w')
-# status_bar.grid(row=len(fields)+1, column=0, columnspan=3, sticky='we')
+# Status bar with the live throughput, read from the same metrics as the JSON-lines log and /metrics endpoint
+status_var = tk.StringVar(value="Ready")
+status_bar = tk.Label(root, textvariable=status_var, bd=1, relief='sunken', anchor='w')
+status_bar.grid(row=len(fields)+1, column=0, columnspan=3, sticky='we')
+last_status = {'time': None, 'pages': 0, 'bytes_out': 0}
+
+
+def update_status():
+    snapshot = metrics.snapshot()
+    counters, gauges = snapshot['counters'], snapshot['gauges']
+    now = snapshot['uptime_s']
+    pages, bytes_out = counters.get('pages', 0), counters.get('bytes_out', 0)
+    if last_status['time'] is not None and now > last_status['time']:
+        elapsed = now - last_status['time']
+        status_var.set(f"{(pages - last_status['pages']) / elapsed:.1f} pages/s, "
+                       f"{(bytes_out - last_status['bytes_out']) / 1024 / 1024 / elapsed:.1f} MB/s out | "
+                       f"pages: {pages}, archives: {counters.get('archives', 0)}, "
+                       f"queued: {gauges.get('queue_depth', 0)}, errors: {counters.get('errors', 0)}")
+    last_status.update(time=now, pages=pages, bytes_out=bytes_out)
+    root.after(1000, update_status)
+
+
+update_status()
 
 # Configure the status bar to expand horizontally
 root.rowconfigure(len(fields) + 1, weight=0)
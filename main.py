@@ -1,33 +1,20 @@
-import os
-import gui
-from DirectoryWatcher import Watcher
-
-default_working_dir = '_target_'
-default_watermark_path = os.path.join(os.path.dirname(os.path.abspath(default_working_dir)), default_working_dir,
-                                      'watermark.png')
-
-DEFAULT_CONFIG = {
-    'unrar_tool': 'C:\\Program Files\\WinRAR\\UnRAR.exe',  # TODO: improve default UbRAR path
-    'WORKING_DIR': default_working_dir,
-    'WATERMARK_FILE': default_watermark_path,
-    'WATERMARK_SIZE': 200,
-    'WATERMARK_OPACITY': 0.75,
-    'OUTPUT_HEIGHT': 1200,
-    'OUTPUT_QUALITY': 80,
-    'PAGE_IGNORE_COUNT': 2,
-    'MAX_WORKERS': (os.cpu_count() or 4) * 2 - 1  # Example formula for I/O-bound tasks
-}
+import multiprocessing
+from config import DEFAULT_CONFIG
 
 
 def main():
+    from DirectoryWatcher import Watcher
     path_to_watch = DEFAULT_CONFIG['WORKING_DIR']
     # os.chmod(path_to_watch, 0o777)  # set the dir to readable, writable and executable
-    print(f"Worker count: {DEFAULT_CONFIG['MAX_WORKERS']}")
+    print(f"Worker count: {DEFAULT_CONFIG['CPU_WORKERS']} (images), {DEFAULT_CONFIG['MAX_WORKERS']} (I/O)")
     w = Watcher(path_to_watch, config=DEFAULT_CONFIG)
     w.run()
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # needed by the process backend in the packaged executable
+    # Imported here so that process workers, which re-import this module, don't open a window
+    import gui
     # main()
     gui.start_watcher()
 
@@ -0,0 +1,173 @@
+"""
+Timing spans, counters and gauges for the watcher, with pluggable sinks.
+
+Handler, Scheduler and the readiness tracker report into the process-wide `metrics` registry. Every span
+and counter update is passed on to the registered sinks (e.g. JsonLinesSink), and MetricsServer serves
+a snapshot in the Prometheus text format.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages timed per archive (extract, zip, move) and per page (decode, watermark, resize, encode)
+SPANS = ('ready_wait', 'queue_wait', 'extract', 'decode', 'watermark', 'resize', 'encode', 'zip', 'move', 'archive')
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.spans = {}  # name -> {'count', 'total_s', 'max_s'}
+        self.gauges = {}  # name -> callable returning the current value
+        self.sinks = []
+        self.started = time.time()
+
+    def add_sink(self, sink):
+        with self.lock:
+            self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        with self.lock:
+            if sink in self.sinks:
+                self.sinks.remove(sink)
+
+    def register_gauge(self, name, read):
+        """read is called whenever a snapshot is taken, e.g. lambda: job_queue.qsize()"""
+        with self.lock:
+            self.gauges[name] = read
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        self.emit({'type': 'counter', 'name': name, 'value': amount, **labels})
+
+    def record_span(self, name, seconds, **labels):
+        with self.lock:
+            stats = self.spans.setdefault(name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+            stats['count'] += 1
+            stats['total_s'] += seconds
+            stats['max_s'] = max(stats['max_s'], seconds)
+        self.emit({'type': 'span', 'name': name, 'seconds': round(seconds, 6), **labels})
+
+    def record_spans(self, timings, **labels):
+        """Records a dict of name -> seconds, as returned by the page stages in utils."""
+        for name, seconds in timings.items():
+            self.record_span(name, seconds, **labels)
+
+    @contextmanager
+    def span(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - start, **labels)
+
+    def emit(self, event):
+        with self.lock:
+            sinks = list(self.sinks)
+        if not sinks:
+            return
+        event = {'ts': round(time.time(), 3), **event}
+        for sink in sinks:
+            try:
+                sink.write(event)
+            except Exception as e:
+                print(f"Error in writing metrics: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            gauges = dict(self.gauges)
+            snapshot = {
+                'uptime_s': round(time.time() - self.started, 3),
+                'counters': dict(self.counters),
+                'spans': {name: dict(stats) for name, stats in self.spans.items()}
+            }
+        snapshot['gauges'] = {}
+        for name, read in gauges.items():
+            try:
+                snapshot['gauges'][name] = read()
+            except Exception:
+                snapshot['gauges'][name] = None
+        return snapshot
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += [f"# TYPE watermark_{name}_total counter", f"watermark_{name}_total {value}"]
+        for name, value in sorted(snapshot['gauges'].items()):
+            if value is not None:
+                lines += [f"# TYPE watermark_{name} gauge", f"watermark_{name} {value}"]
+        if snapshot['spans']:
+            lines.append("# TYPE watermark_stage_seconds summary")
+            for name, stats in sorted(snapshot['spans'].items()):
+                lines.append(f'watermark_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+                lines.append(f'watermark_stage_seconds_sum{{stage="{name}"}} {stats["total_s"]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.spans.clear()
+            self.started = time.time()
+
+
+class JsonLinesSink:
+    """Appends every metrics event to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, event):
+        with self.lock:
+            self.file.write(json.dumps(event, ensure_ascii=False) + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class MetricsServer:
+    """Serves GET /metrics (Prometheus text) and GET /metrics.json on localhost."""
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        # Imported here: http.server is slow to import and only needed when METRICS_PORT is set
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.prometheus_text(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep the console for the pipeline output
+
+        self.server = ThreadingHTTPServer((host, port), RequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        print(f"Metrics served at http://{host}:{port}/metrics")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Process-wide registry used by Handler, Scheduler and the readiness tracker
+metrics = Metrics()
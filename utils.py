@@ -1,13 +1,234 @@
+import io
+import math
 import os
 import shutil
-import zipfile
-from zipfile import ZipFile
+import threading
+import time
 from PIL import Image
 
+from ZipWriter import ZipWriter
+from archives import natural_key
+from alpha import apply_opacity, composite_layer, expand_palette, flatten, has_alpha, to_rgb, watermark_layer
+
+# Pages whose full-size RGB copy would take more than this are resized and watermarked in strips instead,
+# see resize_in_strips()
+STRIP_MIN_BYTES = 64 * 1024 * 1024
+# Source rows per strip
+STRIP_ROWS = 1024
+
+# Prepared watermark layers shared by all workers of the process, see get_watermark()
+_watermark_cache = {}
+_watermark_cache_lock = threading.Lock()
+_watermark_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_watermark(watermark_file, watermark_width, watermark_opacity, scale=1.0):
+    """
+    Returns the prepared watermark layer, building it only once per (path, mtime, width, opacity, scale).
+    Editing or replacing the watermark file changes its mtime, so the next page picks up the new layer.
+
+    The returned image is shared between threads and must be treated as read-only.
+    """
+    path = os.path.abspath(watermark_file)
+    key = (path, os.path.getmtime(path), watermark_width, watermark_opacity, scale)
+
+    with _watermark_cache_lock:
+        watermark = _watermark_cache.get(key)
+        if watermark is not None:
+            _watermark_cache_stats['hits'] += 1
+            return watermark
+
+        _watermark_cache_stats['misses'] += 1
+        # Drop the layers of an outdated watermark file
+        for stale_key in [k for k in _watermark_cache if k[0] == path and k[1] != key[1]]:
+            del _watermark_cache[stale_key]
+        watermark = prepare_watermark(path, max(1, round(watermark_width * scale)), watermark_opacity)
+        _watermark_cache[key] = watermark
+        return watermark
+
+
+def watermark_cache_info():
+    """Returns the hit/miss counters and the number of cached watermark layers."""
+    with _watermark_cache_lock:
+        return {**_watermark_cache_stats, 'size': len(_watermark_cache)}
+
+
+def prepare_watermark(watermark_file, watermark_width, watermark_opacity):
+    """
+    Loads the watermark, resizes it to watermark_width (keeping the aspect ratio) and applies the opacity.
+    Use get_watermark() instead to reuse the layer across pages.
+
+    Returns:
+    - Image: the RGBA watermark layer, ready to be composited (see alpha.watermark_layer)
+    """
+    with Image.open(watermark_file) as source:
+        watermark = source.convert("RGBA")
+
+    # Calculate the scaling factor to maintain aspect ratio
+    original_width, original_height = watermark.size
+    scaling_factor = watermark_width / original_width
+    new_height = int(original_height * scaling_factor)
+
+    # Resize the watermark to the desired width while maintaining aspect ratio
+    watermark = watermark.resize((watermark_width, new_height), Image.Resampling.LANCZOS)
+
+    # Scale the alpha band to set opacity
+    apply_opacity(watermark, watermark_opacity)
+    return watermark_layer(watermark)
+
+
+def composite_watermark(base_image, watermark, margin=10, region_only=True, in_place=False, position=None):
+    """
+    Places the prepared watermark at the bottom-right corner of base_image (or with its top-left corner at
+    position, which may lie outside base_image, e.g. for a strip of a page).
+
+    By default only the region under the watermark is cropped, blended and pasted back, so no full-size
+    RGBA buffers are allocated. region_only=False keeps the original full-canvas alpha_composite.
+    in_place=True lets an RGB base_image be modified instead of copied (the caller owns it).
+
+    Returns:
+    - Image: the watermarked page in RGB mode
+    """
+    # Position watermark at the bottom-right corner of the base image
+    base_width, base_height = base_image.size
+    watermark_width, watermark_height = watermark.size
+
+    watermark_position = position or (
+        base_width - watermark_width - margin,
+        base_height - watermark_height - margin
+    )
+
+    if not region_only:
+        # Create a transparent layer the size of the base image to hold the watermark layer
+        transparent = Image.new('RGBA', base_image.size)
+        transparent.paste(watermark, watermark_position)
+
+        # Combine the base image with the watermark
+        combined = Image.alpha_composite(base_image.convert('RGBA'), transparent)
+        return combined.convert('RGB')
+
+    # Clip the watermark box to the page (the watermark can be larger than a very small page)
+    x, y = watermark_position
+    box = (max(0, x), max(0, y), min(base_width, x + watermark_width), min(base_height, y + watermark_height))
+    combined = base_image if in_place and base_image.mode == 'RGB' else base_image.convert('RGB')
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return combined
+
+    # Blend only the covered region; a page with alpha is blended with its own alpha
+    layer = watermark if box == (x, y, x + watermark_width, y + watermark_height) \
+        else watermark.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y))
+    composite_layer(base_image, layer, box, combined)
+    return combined
+
+
+def resize_to_height(img, output_height):
+    """
+    Resizes img down to output_height (keeping the aspect ratio) and flattens it onto white as RGB.
+    Pages that are already at most output_height high are kept at their size, very large pages are resized
+    in strips.
+    """
+    if use_strips(img, output_height):
+        return resize_in_strips(img, output_height)
+
+    # Palette and bilevel images would only be resized with NEAREST
+    img = expand_palette(img)
+
+    if img.height <= output_height:
+        resized_img = img
+    else:
+        # Calculate the target size maintaining the aspect ratio
+        aspect_ratio = img.width / img.height
+        output_width = int(output_height * aspect_ratio)
+
+        # Resize the image
+        resized_img = img.resize((output_width, output_height), Image.Resampling.LANCZOS)
+
+    # Images with an alpha channel are flattened onto white, other modes converted to RGB (this includes 'L')
+    return to_rgb(resized_img)
+
+
+def resize_in_strips(img, output_height, watermark=None, margin=10):
+    """
+    resize_to_height for very large pages, optionally compositing the watermark like composite_watermark
+    does beforehand. The page is cropped, converted, watermarked and resized one strip of about STRIP_ROWS
+    source rows at a time (plus the rows the LANCZOS filter reaches around it), so besides the decoded page
+    only a strip and the output are held in memory, whatever the page dimensions; no full-size RGB copy is made.
+    The output matches the full-page path up to rounding (a few pixel values off by one).
+    """
+    output_width = int(output_height * img.width / img.height)
+    scale = img.height / output_height
+    support = math.ceil(3 * scale) + 1  # LANCZOS reaches 3 output pixels, i.e. 3 * scale source rows, each way
+    rows = max(8, int(STRIP_ROWS / scale))  # output rows per strip
+    if watermark is not None:
+        position = (img.width - watermark.width - margin, img.height - watermark.height - margin)
+    output = Image.new('RGB', (output_width, output_height), (255, 255, 255))
+
+    for top in range(0, output_height, rows):
+        bottom = min(output_height, top + rows)
+        source_top, source_bottom = top * scale, bottom * scale
+        crop_top = max(0, int(source_top) - support)
+        crop_bottom = min(img.height, math.ceil(source_bottom) + support)
+        strip = img.crop((0, crop_top, img.width, crop_bottom))
+        if watermark is not None:
+            strip = composite_watermark(strip, watermark, in_place=True, position=(position[0], position[1] - crop_top))
+        else:
+            strip = expand_palette(strip)
+        strip = strip.resize((output_width, bottom - top), Image.Resampling.LANCZOS,
+                             box=(0, source_top - crop_top, img.width, source_bottom - crop_top))
+        if strip.mode in ('RGBA', 'LA'):
+            # Flattened onto the white output, like resize_to_height does
+            flatten(strip, output=output, position=(0, top))
+        else:
+            output.paste(strip if strip.mode == 'RGB' else strip.convert('RGB'), (0, top))
+    return output
+
+
+def use_strips(img, output_height):
+    """Whether a decoded page is large enough for resize_in_strips(); RGB pages are never copied at full size."""
+    return img.mode != 'RGB' and img.height > output_height and img.width * img.height * 3 > STRIP_MIN_BYTES
+
+
+def decoded_size(img):
+    """Bytes taken by the decoded pixels of img (as it will be decoded, after draft())."""
+    return img.width * img.height * len(img.getbands())
+
+
+def page_footprint(source, output_height, draft=True):
+    """
+    Estimates the peak memory of the page stage for one page, in bytes, from its header only (nothing is
+    decoded): the decoded page, the full-size copies of the non-strip path (or a strip) and the output.
+
+    Parameters:
+    - source: path or bytes of the page
+    - draft (bool): False for stages that decode the page at full size (apply_watermark)
+
+    Returns:
+    - int: the estimated bytes, 0 when the header cannot be read (the page stage reports the error)
+    """
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            if draft:
+                draft_for_height(img, output_height)
+            width, height, decoded = img.width, img.height, decoded_size(img)
+            strips = use_strips(img, output_height)
+            copied = img.mode != 'RGB'
+    except Exception:
+        return 0
+    output_height = min(height, output_height)
+    output_width = width * output_height // height
+    # The horizontally resized intermediate of LANCZOS
+    work = output_width * height * 4
+    if strips:
+        work += 3 * (STRIP_ROWS + 6 * height // output_height) * width * 4
+    elif copied:
+        work += width * height * 4  # RGB(A) copy of the page
+    return decoded + work + output_width * output_height * 3
+
 
 def apply_watermark(image_path, target_directory, watermark_width, watermark_file, watermark_opacity):
     """
-    Applies a watermark to an image, resizing the watermark to 330px wide while maintaining aspect ratio.
+    Applies a watermark to an image, resizing the watermark to watermark_width while maintaining aspect ratio.
+    Used by the 'legacy' pipeline mode, which saves the page back as PNG before compress_image runs.
 
     Parameters:
     - image_path (str): Path to the base image.
@@ -16,143 +237,246 @@ def apply_watermark(image_path, target_directory, watermark_width, watermark_fil
     - watermark_opacity (float)
 
     Returns:
-    - None
+    - bool: False if the page could not be watermarked (it is left as it is)
     """
-    # print('Watermark file:', watermark_file)
-    watermark_path = watermark_file  # Removed dependency on target_directory
-
     try:
         with Image.open(image_path) as base_image:
-            with Image.open(watermark_path).convert("RGBA") as watermark:
-                # Define the desired watermark width
-                desired_width = watermark_width
-
-                # Calculate the scaling factor to maintain aspect ratio
-                original_width, original_height = watermark.size
-                scaling_factor = desired_width / original_width
-                new_height = int(original_height * scaling_factor)
+            watermark = get_watermark(watermark_file, watermark_width, watermark_opacity)
+            combined = composite_watermark(base_image, watermark)
 
-                # Resize the watermark to the desired width while maintaining aspect ratio
-                watermark = watermark.resize((desired_width, new_height), Image.Resampling.LANCZOS)
+            # Ensure the target directory exists
+            os.makedirs(target_directory, exist_ok=True)
 
-                # Adjust watermark opacity to 45%
+            # Overwrite the original image (through a temporary file, so a crash never leaves half a page)
+            combined.save(image_path + '.tmp', "PNG")
+        os.replace(image_path + '.tmp', image_path)
+        # print(f"Watermark applied and original image replaced: {image_path}")
+        return True
 
-                # Ensure the watermark has an alpha channel
-                if watermark.mode != 'RGBA':
-                    watermark = watermark.convert('RGBA')
-
-                # Split the watermark into its component bands
-                bands = list(watermark.split())
-                # Modify the alpha band to set opacity
-                bands[3] = bands[3].point(lambda x: x * watermark_opacity)
-                # Merge the bands back together
-                watermark = Image.merge('RGBA', bands)
+    except Exception as e:
+        print(f"Error in applying watermark to {image_path}: {e}")
+        return False
 
-                # Position watermark at the bottom-right corner of the base image
-                base_width, base_height = base_image.size
-                watermark_width, watermark_height = watermark.size
-                margin = 10  # Margin from the edges
 
-                watermark_position = (
-                    base_width - watermark_width - margin,
-                    base_height - watermark_height - margin
-                )
+def jpeg_output_path(image_path):
+    """Path of the JPEG written for a page; for .jpg pages it is the page itself, which is then replaced."""
+    return os.path.splitext(image_path)[0] + '.jpg'
 
-                # watermark_position = (0, 0) # testing only
 
-                # Create a transparent layer the size of the base image to hold the watermark
-                transparent = Image.new('RGBA', base_image.size)
-                transparent.paste(watermark, watermark_position, watermark)
+def is_replaced_in_place(image_path):
+    return os.path.normcase(jpeg_output_path(image_path)) == os.path.normcase(image_path)
 
-                # Combine the base image with the watermark
-                combined = Image.alpha_composite(base_image.convert('RGBA'), transparent)
 
-                # Ensure the target directory exists
-                os.makedirs(target_directory, exist_ok=True)
+def finish_page(image_path, output_path):
+    """Moves the JPEG written to output_path + '.tmp' into place and removes the source page."""
+    os.replace(output_path + '.tmp', output_path)
+    if not is_replaced_in_place(image_path):
+        os.remove(image_path)
 
-                # Overwrite the original image
-                combined.convert('RGB').save(image_path, "PNG")
-                # print(f"Watermark applied and original image replaced: {image_path}")
 
-    except Exception as e:
-        print(f"Error in applying watermark to {image_path}: {e}")
+def discard_temp(temp_path):
+    # A failed page is kept as it is, without a partial JPEG next to it
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
 
 
-def compress_image(image_path, output_height, output_quality):
+def compress_image(image_path, output_height, output_quality, encoder=None):
+    """Legacy mode: resizes and encodes a page as JPEG, replacing it. Returns False if the page failed."""
     try:
+        # Define the output path for the JPG file
+        output_path = jpeg_output_path(image_path)
         with Image.open(image_path) as img:
-            # Calculate the target size maintaining the aspect ratio
-            aspect_ratio = img.width / img.height
-            output_width = int(output_height * aspect_ratio)
-
-            # Resize the image
-            resized_img = img.resize((output_width, output_height), Image.Resampling.LANCZOS)
-
-            # Check if the image has an alpha channel
-            if resized_img.mode == 'RGBA' or resized_img.mode == 'LA':
-                # Create a white background image
-                background = Image.new('RGB', resized_img.size, (255, 255, 255))
-                # Composite the resized image onto the background
-                # This checks if the image has an alpha channel and uses it as a mask
-                background.paste(resized_img, mask=resized_img.getchannel('A'))  # Safely get the alpha channel
-                resized_img = background
-            else:
-                # If not 'LA' or 'RGBA', convert other modes directly to 'RGB' (this includes 'L' mode)
-                resized_img = resized_img.convert('RGB')
-
-            # Define the output path for the JPG file
-            output_path = os.path.splitext(image_path)[0] + '.jpg'
+            draft_for_height(img, output_height)
+            resized_img = resize_to_height(img, output_height)
 
             # Save the image in JPG format
-            resized_img.save(output_path, "JPEG", quality=output_quality)
+            from encoder import save_jpeg
+            save_jpeg(resized_img, output_path + '.tmp', output_quality, encoder)
             # print(f"Image compressed and saved as: {output_path}")
 
-            # Remove the original PNG file
-            os.remove(image_path)
-            # print(f"Original image removed: {image_path}")
+        # Replace the original page (closed first, Windows cannot replace an open file)
+        finish_page(image_path, output_path)
+        return True
 
     except Exception as e:
         print(f"Error in compressing {image_path}: {e}")
+        discard_temp(jpeg_output_path(image_path) + '.tmp')
+        return False
+
+
+def draft_for_height(img, output_height):
+    """
+    Lets a JPEG page that is larger than output_height decode at a reduced scale (DCT scaling, 1/2 to 1/8)
+    that is still at least output_height high. Must be called before the page is loaded.
+
+    Returns:
+    - float: the decoded size relative to the original size (1.0 when the page is decoded at full size)
+    """
+    if img.format != 'JPEG' or img.height <= output_height:
+        return 1.0
+    original_height = img.height
+    img.draft(img.mode, (max(1, img.width * output_height // img.height), output_height))
+    return img.height / original_height
+
 
+def watermark_and_resize(img, watermark_width, watermark_file, watermark_opacity, output_height, watermark=True,
+                         timings=None, resize_first=False):
+    """
+    Watermarks (unless watermark is False) and resizes a decoded page, returning the RGB image to encode.
+    When a timings dict is given, the seconds spent per step are added to it.
+
+    JPEG pages larger than output_height are decoded at a reduced scale (see draft_for_height); the watermark
+    and its margin are scaled by the same factor, so it ends up with the same size on the output page.
+
+    resize_first=True (WATERMARK_ORDER 'resize_first') resizes the page first and composites a watermark
+    pre-scaled to the output size, with the margin scaled the same way: same placement, but the blend runs over
+    the output pixels only and the watermark is not blurred by the downscale. Very large transparent pages keep
+    the watermark-first strip path (their strips are watermarked before they are resized).
+    """
+    start = time.perf_counter()
+    original_height = img.height
+    scale = draft_for_height(img, output_height)
+    img.load()
+    decoded = time.perf_counter()
+    if resize_first and not (watermark and has_alpha(img) and use_strips(img, output_height)):
+        if watermark and has_alpha(img):
+            # composite_watermark drops the alpha band of a watermarked page, so it is dropped before resizing
+            img = img.convert('RGB')
+        resized_img = resize_to_height(img, output_height)
+        resized = time.perf_counter()
+        if watermark:
+            # The output page relative to the original page, whether the page was drafted or not
+            scale = resized_img.height / original_height
+            layer = get_watermark(watermark_file, max(1, round(watermark_width * scale)), watermark_opacity)
+            resized_img = composite_watermark(resized_img, layer, margin=round(10 * scale), in_place=True)
+        if timings is not None:
+            timings['decode'] = decoded - start
+            timings['resize'] = resized - decoded
+            if watermark:
+                timings['watermark'] = time.perf_counter() - resized
+        return resized_img
+    if use_strips(img, output_height):
+        # No full-size RGB copy of a very large page: the watermark is composited strip by strip
+        layer = get_watermark(watermark_file, watermark_width, watermark_opacity, scale) if watermark else None
+        resized_img = resize_in_strips(img, output_height, layer, round(10 * scale))
+        if timings is not None:
+            timings['decode'] = decoded - start
+            timings['resize'] = time.perf_counter() - decoded
+        return resized_img
+    if watermark:
+        img = composite_watermark(img, get_watermark(watermark_file, watermark_width, watermark_opacity, scale),
+                                  margin=round(10 * scale), in_place=True)
+    watermarked = time.perf_counter()
+    resized_img = resize_to_height(img, output_height)
+    if timings is not None:
+        timings['decode'] = decoded - start
+        if watermark:
+            timings['watermark'] = watermarked - decoded
+        timings['resize'] = time.perf_counter() - watermarked
+    return resized_img
+
+
+def watermark_and_compress(image_path, watermark_width, watermark_file, watermark_opacity, output_height,
+                           output_quality, watermark=True, resize_first=False, encoder=None):
+    """
+    Fused single-pass page stage: decode once, composite the watermark, resize and encode the JPEG once.
+    Produces the same output as apply_watermark followed by compress_image, without the intermediate PNG.
 
-def compress_and_move_folder(folder_to_compress, final_zip_directory, zip_name):
-    # Create a temporary path for the zip file
-    temp_zip_path = os.path.join(final_zip_directory, f"{zip_name}.zip")
+    Parameters:
+    - image_path (str): Path to the source page (PNG, JPEG or WebP), replaced by the JPEG.
+    - watermark (bool): False for pages that only need to be compressed (e.g. credit pages)
+    - resize_first (bool): resize before compositing the watermark, see watermark_and_resize
+    - encoder (JpegSettings): JPEG options and quality search (see encoder.py), None to save with output_quality
 
-    # Step 1: Compress the folder into a zip file
+    Returns:
+    - dict: seconds per step plus 'bytes_in' and 'bytes_out', or None if the page could not be processed
+    """
     try:
-        with zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        stats = {'bytes_in': os.path.getsize(image_path)}
+        with Image.open(image_path) as img:
+            resized_img = watermark_and_resize(img, watermark_width, watermark_file, watermark_opacity,
+                                               output_height, watermark, stats, resize_first)
+
+            start = time.perf_counter()
+            output_path = jpeg_output_path(image_path)
+            from encoder import save_jpeg
+            stats['encode_attempts'] = save_jpeg(resized_img, output_path + '.tmp', output_quality, encoder)
+            stats['encode'] = time.perf_counter() - start
+
+        finish_page(image_path, output_path)
+        stats['bytes_out'] = os.path.getsize(output_path)
+        return stats
+
+    except Exception as e:
+        print(f"Error in processing {image_path}: {e}")
+        discard_temp(jpeg_output_path(image_path) + '.tmp')
+        return None
+
+
+def watermark_and_compress_bytes(data, watermark_width, watermark_file, watermark_opacity, output_height,
+                                 output_quality, watermark=True, name='', resize_first=False, encoder=None):
+    """
+    In-memory variant of watermark_and_compress used by the streaming mode.
+
+    Returns:
+    - tuple: the encoded JPEG and the stats of watermark_and_compress, or (None, None) if the page failed
+    """
+    try:
+        stats = {'bytes_in': len(data)}
+        with Image.open(io.BytesIO(data)) as img:
+            resized_img = watermark_and_resize(img, watermark_width, watermark_file, watermark_opacity,
+                                               output_height, watermark, stats, resize_first)
+            start = time.perf_counter()
+            from encoder import encode_jpeg
+            output, stats['encode_attempts'] = encode_jpeg(resized_img, output_quality, encoder)
+            stats['encode'] = time.perf_counter() - start
+            stats['bytes_out'] = len(output)
+            return output, stats
+
+    except Exception as e:
+        print(f"Error in processing {name}: {e}")
+        return None, None
+
+
+def compress_and_move_folder(folder_to_compress, final_zip_directory, zip_name, zip_mode='auto', executor=None,
+                             add_members=None, exclude=()):
+    """
+    Zips the folder straight into final_zip_directory (the parent directory of '_target_' when empty)
+    and deletes the folder afterwards.
+
+    zip_mode is passed to ZipWriter: 'auto' stores the JPEG pages and deflates the rest, in parallel on executor.
+    add_members, if given, is called with the ZipWriter to add members that are not in the folder
+    (e.g. Archive.copy_raw). Files listed in exclude are left out of the zip (and deleted with the folder).
+
+    Returns:
+    - str: path of the zip file, or None if it could not be written
+    """
+    if not final_zip_directory:
+        final_zip_directory = os.path.dirname(os.path.dirname(folder_to_compress))
+    final_zip_path = os.path.join(final_zip_directory, f"{zip_name}.zip")
+
+    try:
+        # Step 1: Compress the folder into a zip file at its final location
+        with ZipWriter(final_zip_path, zip_mode, executor) as writer:
             for root, dirs, files in os.walk(folder_to_compress):
-                for file in files:
+                # Pages are stored in reading order
+                dirs.sort(key=natural_key)
+                for file in sorted(files, key=natural_key):
                     file_path = os.path.join(root, file)
-                    # Exclude the zip file itself
-                    if file_path != temp_zip_path:
-                        zipf.write(file_path, os.path.relpath(file_path, os.path.dirname(folder_to_compress)))
-
-        print(f"Folder '{folder_to_compress}' is compressed into: {temp_zip_path}")
+                    if file_path in exclude:
+                        continue
+                    writer.add_file(file_path, os.path.relpath(file_path, os.path.dirname(folder_to_compress)))
+            if add_members:
+                add_members(writer)
 
-        # Step 2: Move the zip file to the parent directory of '_target_'
-        target_parent_directory = os.path.dirname(os.path.dirname(folder_to_compress))
-        final_zip_path = os.path.join(target_parent_directory, f"{zip_name}.zip")
-        shutil.move(temp_zip_path, final_zip_path)
-        print(f"Zip file moved to: {final_zip_path}")
+        print(f"Folder '{folder_to_compress}' is compressed into: {final_zip_path} "
+              f"({writer.bytes_in / 1024 / 1024:.1f} MB at {writer.throughput():.1f} MB/s, {zip_mode})")
 
-        # Step 3: Delete the original folder after successful zipping
+        # Step 2: Delete the original folder after successful zipping
         shutil.rmtree(folder_to_compress)
         # print(f"Original folder deleted: {folder_to_compress}")
+        return final_zip_path
 
     except Exception as e:
         print(f"Error during compression or folder deletion: {e}")
-
-
-# credit: https://blog.csdn.net/qq_21076851/article/details/122752196
-def support_gbk(zip_file: ZipFile):
-    name_to_info = zip_file.NameToInfo
-
-    for name, info in name_to_info.copy().items():
-        real_name = name.encode('cp437').decode('gbk')
-        if real_name != name:
-            info.filename = real_name
-            del name_to_info[name]
-            name_to_info[real_name] = info
-    return zip_file
+        return None